@@ -1,6 +1,7 @@
 """Example of extending the Boxing Gym Agent for custom use cases."""
 
 import asyncio
+from email.utils import parseaddr
 from typing import Optional
 from loguru import logger
 
@@ -95,6 +96,21 @@ class MultiGymAgent(BoxingGymAgent):
                 "timezone": "America/Los_Angeles",
             }
         }
+        
+        # Precompute sender lookups so identifying a gym is a dict lookup
+        self._email_to_config = {
+            config["email"].lower(): config for config in self.gym_configs.values()
+        }
+        self._domain_to_config = {}
+        shared_domains = set()
+        for config in self.gym_configs.values():
+            domain = config["email"].rsplit("@", 1)[-1].lower()
+            if domain in self._domain_to_config:
+                shared_domains.add(domain)
+            self._domain_to_config[domain] = config
+        # A domain used by several gyms cannot identify one of them
+        for domain in shared_domains:
+            del self._domain_to_config[domain]
     
     async def _handle_confirmation_email(self, processed_email: ProcessedEmail) -> None:
         """Handle confirmations with gym-specific logic."""
@@ -111,10 +127,11 @@ class MultiGymAgent(BoxingGymAgent):
     
     def _identify_gym(self, from_email: str) -> Optional[dict]:
         """Identify which gym an email is from."""
-        for gym_name, config in self.gym_configs.items():
-            if config["email"] in from_email:
-                return config
-        return None
+        address = parseaddr(from_email)[1].lower()
+        config = self._email_to_config.get(address)
+        if config is None:
+            config = self._domain_to_config.get(address.rsplit("@", 1)[-1])
+        return config
     
     async def _apply_gym_specific_processing(self, processed_email: ProcessedEmail, gym_config: dict) -> None:
         """Apply gym-specific processing logic."""
@@ -171,8 +188,7 @@ async def main():
     
     # Keep running
     try:
-        while agent.is_running:
-            await asyncio.sleep(1)
+        await agent.wait_until_stopped()
     except KeyboardInterrupt:
         agent.stop()
 
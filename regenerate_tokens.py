@@ -6,6 +6,9 @@ This is needed when we add new API scopes to the application.
 
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -17,21 +20,35 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.modify',
     'https://www.googleapis.com/auth/calendar',  # Full calendar access
 ]
+REQUIRED_SCOPES = frozenset(SCOPES)
 
 def regenerate_tokens():
     """Regenerate OAuth2 tokens with updated scopes."""
     creds = None
+    original_token = None
     
     # Check if we have existing tokens
     if os.path.exists('tokens.json'):
         print("Found existing tokens.json")
         try:
-            creds = Credentials.from_authorized_user_file('tokens.json', SCOPES)
+            # Keep the scopes recorded in the file so they can be checked against SCOPES
+            creds = Credentials.from_authorized_user_file('tokens.json')
+            original_token = creds.token
             print("Loaded existing credentials")
         except Exception as e:
             print(f"Error loading existing credentials: {e}")
             creds = None
     
+    # Refreshing cannot add scopes, so tokens missing one need the OAuth2 flow again
+    if creds and not REQUIRED_SCOPES.issubset(creds.scopes or []):
+        print("Existing tokens are missing required scopes")
+        creds = None
+    
+    # Nothing to regenerate if the token is valid and already grants every scope
+    if creds and creds.valid:
+        print("Tokens still valid with all required scopes, nothing to do")
+        return
+    
     # If there are no (valid) credentials available, let the user log in
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -59,29 +76,48 @@ def regenerate_tokens():
             creds = flow.run_local_server(port=0)
             print("OAuth2 flow completed successfully")
     
-    # Save the credentials for the next run
-    with open('tokens.json', 'w') as token:
-        token.write(creds.to_json())
-    print("Tokens saved to tokens.json")
+    # Save the credentials for the next run, skipping the write if nothing changed
+    if creds.token != original_token:
+        with open('tokens.json', 'w') as token:
+            token.write(creds.to_json())
+        print("Tokens saved to tokens.json")
+    else:
+        print("Tokens unchanged, tokens.json not rewritten")
     
     # Test the credentials with both Gmail and Calendar APIs
     print("\nTesting API access...")
     
-    try:
-        # Test Gmail API
-        gmail_service = build('gmail', 'v1', credentials=creds)
-        profile = gmail_service.users().getProfile(userId='me').execute()
-        print(f"✅ Gmail API: Connected as {profile.get('emailAddress')}")
-    except Exception as e:
-        print(f"❌ Gmail API: Error - {e}")
+    def test_gmail():
+        gmail_service = build('gmail', 'v1', credentials=creds, static_discovery=True)
+        request = gmail_service.users().getProfile(userId='me')
+        return request, lambda profile: f"✅ Gmail API: Connected as {profile.get('emailAddress')}"
+    
+    def test_calendar():
+        calendar_service = build('calendar', 'v3', credentials=creds, static_discovery=True)
+        request = calendar_service.calendarList().list()
+        return request, lambda calendar_list: (
+            f"✅ Calendar API: Connected, found {len(calendar_list.get('items', []))} calendars"
+        )
+    
+    probes = {}
+    for name, build_probe in (("Gmail", test_gmail), ("Calendar", test_calendar)):
+        try:
+            probes[name] = build_probe()
+        except Exception as e:
+            print(f"❌ {name} API: Error - {e}")
     
-    try:
-        # Test Calendar API
-        calendar_service = build('calendar', 'v3', credentials=creds)
-        calendar_list = calendar_service.calendarList().list().execute()
-        print(f"✅ Calendar API: Connected, found {len(calendar_list.get('items', []))} calendars")
-    except Exception as e:
-        print(f"❌ Calendar API: Error - {e}")
+    # Run the probes concurrently; httplib2 is not thread-safe, so each gets its own connection
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            executor.submit(request.execute, http=AuthorizedHttp(creds, http=httplib2.Http())): (name, describe)
+            for name, (request, describe) in probes.items()
+        }
+        for future in as_completed(futures):
+            name, describe = futures[future]
+            try:
+                print(describe(future.result()))
+            except Exception as e:
+                print(f"❌ {name} API: Error - {e}")
     
     print("\n🎉 Token regeneration complete!")
     print("You can now upload the new tokens.json to Secret Manager:")
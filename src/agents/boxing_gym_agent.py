@@ -1,28 +1,142 @@
 """Main Boxing Gym Agent with LLM-based email processing."""
 
 import asyncio
-import schedule
-import time
-from typing import Set, Dict, Any, Optional
+import hashlib
+import re
+import string
+import sys
+from contextvars import ContextVar
+from typing import Set, Dict, Any, Iterator, List, Optional, Callable, Awaitable
 from datetime import datetime
+from cachetools import TTLCache
 from loguru import logger
 
 from ..services.gmail_service import GmailService
-from ..services.llm_service import LLMService
+from ..services.llm_service import LLMService, html_to_text, parse_json_response
 from ..services.calendar_service import CalendarService
 from ..config.settings import settings, validate_settings
-from ..models.email_models import ProcessedEmail, AgentStatus, ClassDetails
+from ..models.email_models import EmailMetadata, EmailType, ProcessedEmail, AgentStatus, ClassDetails
+
+
+# Prompt for extracting class details from Google Forms confirmation emails
+_GOOGLE_FORMS_PROMPT = string.Template("""
+You are an AI assistant that extracts class details from Google Forms confirmation emails.
+
+Email Details:
+- Subject: $subject
+- Body: $body
+
+This is a Google Forms confirmation email for a boxing class registration. The email contains the user's form responses. Please carefully extract the following information from the email body and respond with a JSON object:
+
+{
+    "class_name": "Exact class name from the form (e.g., 'INTERMEDIATE CLASS', 'BEGINNER CLASS', 'ADVANCE CLASS')",
+    "date": "Date in YYYY-MM-DD format (e.g., '2025-10-10' for Friday, October 10)",
+    "time": "Time in HH:MM format (e.g., '18:15' for 6:15pm)",
+    "instructor": "Instructor/coach name (e.g., 'Coach Hashim', 'Hashim')",
+    "location": "Location/address if mentioned",
+    "class_type": "Type of class (e.g., 'boxing', 'kickboxing', 'fitness')",
+    "difficulty": "Difficulty level (e.g., 'intermediate', 'beginner', 'advanced')",
+    "duration_minutes": "Duration in minutes if mentioned",
+    "equipment_needed": ["List of equipment needed"],
+    "notes": "Any additional notes"
+}
+
+CRITICAL: Look for the CLASS SCHEDULE section in the email. The user's selected class will be marked with a checkmark (✓) symbol.
+
+IMPORTANT: DO NOT extract from the first line in the CLASS SCHEDULE section. The first line is NOT the selected class.
+
+The selected class will have a checkmark (✓) symbol. Look for this exact pattern:
+
+✓
+INTERMEDIATE CLASS - Friday, October 10 @ 6:15pm -- Coach Hashim
+
+OR
+
+✓ INTERMEDIATE CLASS - Friday, October 10 @ 6:15pm -- Coach Hashim
+
+The checkmark (✓) indicates the user's selection. Extract ONLY from the line that has the checkmark (✓).
+
+Extract the EXACT information from the line that has the checkmark (✓). Parse:
+- Class name: "INTERMEDIATE CLASS"
+- Date: "Friday, October 10" → convert to "2025-10-10"
+- Time: "6:15pm" → convert to "18:15"
+- Coach: "Coach Hashim" or just "Hashim"
+
+WARNING: Do not extract from any line without a checkmark (✓). Only extract from the line that has the checkmark symbol.
+
+If any information is not available, use null for that field.
+
+Respond with valid JSON only, no additional text.
+""")
+
+
+# Markers that introduce the user's answers in a Google Forms confirmation
+_FORM_RESPONSE_MARKER_RE = re.compile(r"Your response|Here's a copy of your responses|CLASS SCHEDULE", re.IGNORECASE)
+_FORM_RESPONSE_MAX_CHARS = 4000
+
+
+def _slice_form_response(body: str) -> str:
+    """Reduce a confirmation body to the form response section sent to the LLM."""
+    # Line breaks are kept: the prompt relies on the checkmark line layout
+    body = html_to_text(body)
+    
+    match = _FORM_RESPONSE_MARKER_RE.search(body)
+    start = match.start() if match else 0
+    return body[start:start + _FORM_RESPONSE_MAX_CHARS].strip()
+
+
+# Message IDs to label as processed at the end of the current batch, keyed by whether to also mark them read
+_pending_marks: ContextVar[Optional[Dict[bool, List[str]]]] = ContextVar("_pending_marks", default=None)
 
 
 class BoxingGymAgent:
     """Main agent for processing boxing gym emails with LLM intelligence."""
     
+    # Bounds for the in-memory record of processed message IDs
+    PROCESSED_CACHE_SIZE = 10_000
+    PROCESSED_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+    
+    # Bounds for memoized Google Forms extractions, keyed by email content hash
+    EXTRACTION_CACHE_SIZE = 1024
+    EXTRACTION_CACHE_TTL_SECONDS = 24 * 60 * 60
+    
+    # Maximum number of calendar requests in flight
+    CALENDAR_CONCURRENCY = 10
+    
+    # Refresh OAuth tokens this long before they expire
+    TOKEN_REFRESH_MARGIN_SECONDS = 5 * 60
+    TOKEN_REFRESH_RETRY_SECONDS = 60
+    
+    # Subjects of Google Forms confirmation emails; subclasses may extend the form names
+    GOOGLE_FORMS_SUBJECT_RE = re.compile(r"Thanks for filling out this form: Boxing Class Registration")
+    
     def __init__(self):
         self.gmail_service = GmailService()
         self.llm_service = LLMService()
         self.calendar_service: Optional[CalendarService] = None
-        self.processed_emails: Set[str] = set()
+        self.processed_emails: TTLCache = TTLCache(
+            maxsize=self.PROCESSED_CACHE_SIZE,
+            ttl=self.PROCESSED_CACHE_TTL_SECONDS
+        )
         self.is_running = False
+        self._stopped = asyncio.Event()
+        self._poll_task: Optional[asyncio.Task] = None
+        self._token_refresh_task: Optional[asyncio.Task] = None
+        self._llm_sem = asyncio.Semaphore(settings.llm_concurrency)
+        self._calendar_sem = asyncio.Semaphore(self.CALENDAR_CONCURRENCY)
+        self._extraction_cache: TTLCache = TTLCache(
+            maxsize=self.EXTRACTION_CACHE_SIZE,
+            ttl=self.EXTRACTION_CACHE_TTL_SECONDS
+        )
+        # Per-content lock and the number of coroutines holding or waiting for it
+        self._extraction_locks: Dict[str, List[Any]] = {}
+        # Handlers by email type; subclasses may register additional types
+        self.email_handlers: Dict[str, Callable[[ProcessedEmail], Awaitable[None]]] = {
+            EmailType.REGISTRATION_FORM: self._handle_registration_form,
+            EmailType.CONFIRMATION: self._handle_confirmation_email,
+            EmailType.CANCELLATION: self._handle_cancellation_email,
+            EmailType.WAITLIST: self._handle_waitlist_email,
+        }
         self.status = AgentStatus(
             is_running=False,
             processed_emails_count=0,
@@ -56,50 +170,70 @@ class BoxingGymAgent:
         
         self.is_running = True
         self.status.is_running = True
+        self._stopped.clear()
         logger.info("Starting Boxing Gym Agent...")
         
         # Process existing emails first
         await self.process_existing_emails()
         
-        # Set up periodic checking
-        self._setup_scheduler()
-        
-        # Start the monitoring loop
-        await self._run_monitoring_loop()
+        # Start periodic checking and token refresh in the background
+        self._poll_task = asyncio.create_task(self._poll_loop())
+        self._token_refresh_task = asyncio.create_task(self._token_refresh_loop())
+        logger.info(f"Scheduled email checking every {settings.check_interval_minutes} minutes")
     
     def stop(self) -> None:
         """Stop the agent."""
         self.is_running = False
         self.status.is_running = False
-        schedule.clear()
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._token_refresh_task:
+            self._token_refresh_task.cancel()
+            self._token_refresh_task = None
+        self._stopped.set()
         logger.info("Boxing Gym Agent stopped")
     
-    def _setup_scheduler(self) -> None:
-        """Set up the periodic email checking schedule."""
-        schedule.every(settings.check_interval_minutes).minutes.do(
-            lambda: asyncio.create_task(self.check_for_new_emails())
-        )
-        logger.info(f"Scheduled email checking every {settings.check_interval_minutes} minutes")
+    async def wait_until_stopped(self) -> None:
+        """Wait until the agent is stopped."""
+        await self._stopped.wait()
     
-    async def _run_monitoring_loop(self) -> None:
-        """Run the main monitoring loop."""
+    async def _poll_loop(self) -> None:
+        """Check for new emails every check interval until the agent stops."""
+        interval = settings.check_interval_minutes * 60
         while self.is_running:
+            await asyncio.sleep(interval)
             try:
-                schedule.run_pending()
-                await asyncio.sleep(1)
+                await self.check_for_new_emails()
             except Exception as e:
                 logger.error(f"Error in monitoring loop: {e}")
                 self.status.errors_count += 1
-                await asyncio.sleep(5)  # Wait before retrying
+    
+    async def _token_refresh_loop(self) -> None:
+        """Refresh OAuth credentials shortly before they expire so API calls never wait on it."""
+        while self.is_running:
+            credentials = self.gmail_service.credentials
+            if credentials and credentials.expiry:
+                # google-auth stores expiry as a naive UTC datetime
+                remaining = (credentials.expiry - datetime.utcnow()).total_seconds()
+                delay = max(0, remaining - self.TOKEN_REFRESH_MARGIN_SECONDS)
+            else:
+                delay = 0
+            await asyncio.sleep(delay)
+            
+            try:
+                await asyncio.to_thread(self.gmail_service.refresh_credentials)
+            except Exception as e:
+                logger.error(f"Error refreshing credentials: {e}")
+                self.status.errors_count += 1
+                await asyncio.sleep(self.TOKEN_REFRESH_RETRY_SECONDS)
     
     async def process_existing_emails(self) -> None:
         """Process existing emails in the inbox."""
         try:
             logger.info("Processing existing emails...")
-            messages = self.gmail_service.search_emails(max_results=settings.max_emails_per_check)
-            
-            for message in messages:
-                await self.process_email(message['id'])
+            messages = await self._search_unprocessed_emails()
+            await self._process_messages(messages)
                 
         except Exception as e:
             logger.error(f"Error processing existing emails: {e}")
@@ -108,14 +242,12 @@ class BoxingGymAgent:
     async def check_for_new_emails(self) -> None:
         """Check for new emails and process them."""
         try:
-            messages = self.gmail_service.search_emails(max_results=settings.max_emails_per_check)
+            messages = await self._search_unprocessed_emails()
             new_messages = [msg for msg in messages if msg['id'] not in self.processed_emails]
             
             if new_messages:
                 logger.info(f"Found {len(new_messages)} new emails to process")
-                
-                for message in new_messages:
-                    await self.process_email(message['id'])
+                await self._process_messages(new_messages)
             
             self.status.last_check = datetime.now()
             
@@ -123,18 +255,65 @@ class BoxingGymAgent:
             logger.error(f"Error checking for new emails: {e}")
             self.status.errors_count += 1
     
+    async def _search_unprocessed_emails(self) -> List[Dict[str, str]]:
+        """Search for matching emails that do not yet carry the processed label."""
+        return await asyncio.to_thread(
+            self.gmail_service.search_emails,
+            max_results=settings.max_emails_per_check,
+            extra_query=f"-label:{GmailService.PROCESSED_LABEL}"
+        )
+    
+    async def _process_messages(self, messages: List[Dict[str, str]]) -> None:
+        """Fetch unprocessed messages in one batch and process them concurrently."""
+        message_ids = [msg['id'] for msg in messages if msg['id'] not in self.processed_emails]
+        if not message_ids:
+            return
+        
+        emails = await asyncio.to_thread(self.gmail_service.batch_get_emails, message_ids)
+        
+        # Collect the Gmail label updates of the whole batch and send them together
+        pending_marks: Dict[bool, List[str]] = {True: [], False: []}
+        token = _pending_marks.set(pending_marks)
+        try:
+            await asyncio.gather(
+                *(self._classify_and_handle(email) for email in emails),
+                return_exceptions=True
+            )
+        finally:
+            _pending_marks.reset(token)
+        
+        for mark_read, ids in pending_marks.items():
+            if ids:
+                await asyncio.to_thread(self.gmail_service.batch_mark_as_processed, ids, mark_read=mark_read)
+    
     async def process_email(self, message_id: str) -> None:
         """Process a single email with LLM classification."""
+        if message_id in self.processed_emails:
+            return
+        
+        try:
+            # Get email details
+            email_metadata = await asyncio.to_thread(self.gmail_service.get_email, message_id)
+        except Exception as e:
+            logger.error(f"Error processing email {message_id}: {e}")
+            self.status.errors_count += 1
+            return
+        
+        await self._classify_and_handle(email_metadata)
+    
+    async def _classify_and_handle(self, email_metadata: EmailMetadata) -> None:
+        """Classify a fetched email with the LLM and act on the result."""
+        # Interned IDs share one string object across the pipeline and the processed cache
+        message_id = sys.intern(email_metadata.id)
         try:
             if message_id in self.processed_emails:
                 return
             
-            # Get email details
-            email_metadata = self.gmail_service.get_email(message_id)
-            logger.info(f"Processing email: {email_metadata.subject}")
+            logger.info("Processing email: {}", email_metadata.subject)
             
-            # Classify email using LLM
-            classification = self.llm_service.classify_email(email_metadata)
+            # Classify email using LLM, bounding the number of calls in flight
+            async with self._llm_sem:
+                classification = await self.llm_service.classify_email_async(email_metadata)
             
             # Create processed email object
             processed_email = ProcessedEmail(
@@ -146,40 +325,46 @@ class BoxingGymAgent:
             await self._handle_classified_email(processed_email)
             
             # Mark as processed in memory and Gmail
-            self.processed_emails.add(message_id)
+            self.processed_emails[message_id] = True
             self.status.processed_emails_count += 1
-            processed_email.processed = True
             
-            # Mark email with Gmail label for persistence across restarts
-            self.gmail_service.mark_as_processed(message_id)
+            # Mark email with Gmail label for persistence across restarts, unless
+            # the handler already did so while marking it as read
+            if not processed_email.processed:
+                await self._mark_processed(processed_email)
             
-            logger.info(f"Email {message_id} processed successfully")
+            logger.info("Email {} processed successfully", message_id)
             
         except Exception as e:
             logger.error(f"Error processing email {message_id}: {e}")
             self.status.errors_count += 1
     
+    async def _mark_processed(self, processed_email: ProcessedEmail, mark_read: bool = False) -> None:
+        """Label the email as processed in Gmail, marking it read in the same request if asked."""
+        pending_marks = _pending_marks.get()
+        if pending_marks is not None:
+            # Sent with the rest of the batch by _process_messages
+            pending_marks[mark_read].append(processed_email.metadata.id)
+        else:
+            await asyncio.to_thread(self.gmail_service.mark_as_processed, processed_email.metadata.id, mark_read=mark_read)
+        processed_email.processed = True
+    
     async def _handle_classified_email(self, processed_email: ProcessedEmail) -> None:
         """Handle email based on LLM classification."""
         classification = processed_email.classification
         
         # Check confidence threshold
         if classification.confidence < settings.confidence_threshold:
-            logger.warning(f"Low confidence classification ({classification.confidence:.2f}): {classification.reasoning}")
+            logger.warning("Low confidence classification ({:.2f}): {}", classification.confidence, classification.reasoning)
             return
         
-        logger.info(f"Email classified as: {classification.email_type} (confidence: {classification.confidence:.2f})")
-        logger.info(f"Action required: {classification.action_required}")
+        logger.info("Email classified as: {} (confidence: {:.2f})", classification.email_type, classification.confidence)
+        logger.info("Action required: {}", classification.action_required)
         
         # Handle different email types
-        if classification.email_type == "registration_form":
-            await self._handle_registration_form(processed_email)
-        elif classification.email_type == "confirmation":
-            await self._handle_confirmation_email(processed_email)
-        elif classification.email_type == "cancellation":
-            await self._handle_cancellation_email(processed_email)
-        elif classification.email_type == "waitlist":
-            await self._handle_waitlist_email(processed_email)
+        handler = self.email_handlers.get(classification.email_type)
+        if handler:
+            await handler(processed_email)
         else:
             logger.info(f"No specific handling for email type: {classification.email_type}")
     
@@ -187,18 +372,18 @@ class BoxingGymAgent:
         """Handle registration form emails."""
         classification = processed_email.classification
         
-        logger.info(f"Found registration form: {processed_email.metadata.subject}")
-        logger.info(f"Form links: {classification.form_links}")
-        logger.info(f"Registration URL: {classification.registration_url}")
+        logger.info("Found registration form: {}", processed_email.metadata.subject)
+        logger.info("Form links: {}", classification.form_links)
+        logger.info("Registration URL: {}", classification.registration_url)
         
         if classification.class_details:
-            logger.info("Class details extracted:", classification.class_details.dict())
+            logger.opt(lazy=True).info("Class details extracted: {}", lambda: classification.class_details.model_dump())
         
         # Log form information for manual review
         logger.info("Registration form details logged for review")
         
-        # Mark email as read
-        self.gmail_service.mark_as_read(processed_email.metadata.id)
+        # Mark email as read and processed
+        await self._mark_processed(processed_email, mark_read=True)
         
         # Future: Could implement automatic form submission here
         if settings.enable_auto_registration:
@@ -208,11 +393,11 @@ class BoxingGymAgent:
         """Handle confirmation emails, especially Google Forms confirmations."""
         classification = processed_email.classification
         
-        logger.info(f"Found confirmation email: {processed_email.metadata.subject}")
+        logger.info("Found confirmation email: {}", processed_email.metadata.subject)
         
         # Check if this is a Google Forms confirmation
-        is_google_forms_confirmation = (
-            "Thanks for filling out this form: Boxing Class Registration" in processed_email.metadata.subject
+        is_google_forms_confirmation = bool(
+            self.GOOGLE_FORMS_SUBJECT_RE.search(processed_email.metadata.subject)
         )
         
         if is_google_forms_confirmation:
@@ -220,135 +405,106 @@ class BoxingGymAgent:
             
             # Always extract from Google Forms using specialized prompt
             logger.info("Extracting class details from Google Forms confirmation using specialized extraction")
-            classification.class_details = await self._extract_google_forms_details(processed_email)
+            class_details = await self._extract_google_forms_details(processed_email)
+            classification = classification.model_copy(update={"class_details": class_details})
+            processed_email.classification = classification
         
         if not classification.class_details:
             logger.warning("No class details found in confirmation email")
             return
         
         # Log extracted class details
+        class_details = classification.class_details
         logger.info("Class details extracted:")
-        logger.info(f"  - Class: {classification.class_details.class_name}")
-        logger.info(f"  - Date: {classification.class_details.date}")
-        logger.info(f"  - Time: {classification.class_details.time}")
-        logger.info(f"  - Instructor: {classification.class_details.instructor}")
-        logger.info(f"  - Location: {classification.class_details.location}")
+        logger.info("  - Class: {}", class_details.class_name)
+        logger.info("  - Date: {}", class_details.date)
+        logger.info("  - Time: {}", class_details.time)
+        logger.info("  - Instructor: {}", class_details.instructor)
+        logger.info("  - Location: {}", class_details.location)
         
         # Create calendar event if enabled
         if settings.enable_calendar_creation:
-            try:
-                event = self.calendar_service.create_class_event(
-                    classification.class_details,
-                    processed_email.metadata.id
-                )
-                
-                if event:
-                    logger.info(f"Created calendar event: {event['id']}")
-                    logger.info(f"Event title: {event.get('summary', 'N/A')}")
-                    logger.info(f"Event start: {event.get('start', {}).get('dateTime', 'N/A')}")
-                    self.status.successful_actions += 1
-                else:
-                    logger.info("Calendar event already exists or creation skipped")
+            async with self._calendar_sem:
+                try:
+                    # Create the event while the email is marked as read and processed
+                    event, _ = await asyncio.gather(
+                        self.calendar_service.create_class_event_async(
+                            classification.class_details,
+                            processed_email.metadata.id
+                        ),
+                        self._mark_processed(processed_email, mark_read=True)
+                    )
                     
-            except Exception as e:
-                logger.error(f"Error creating calendar event: {e}")
-                self.status.errors_count += 1
+                    if event:
+                        logger.info(f"Created calendar event: {event['id']}")
+                        logger.info(f"Event title: {event.get('summary', 'N/A')}")
+                        logger.info(f"Event start: {event.get('start', {}).get('dateTime', 'N/A')}")
+                        self.status.successful_actions += 1
+                    else:
+                        logger.info("Calendar event already exists or creation skipped")
+                        
+                except Exception as e:
+                    logger.error(f"Error creating calendar event: {e}")
+                    self.status.errors_count += 1
         else:
             logger.info("Calendar creation is disabled - skipping event creation")
-        
-        # Mark email as read
-        self.gmail_service.mark_as_read(processed_email.metadata.id)
+            
+            # Mark email as read and processed
+            await self._mark_processed(processed_email, mark_read=True)
     
     async def _extract_google_forms_details(self, processed_email: ProcessedEmail) -> Optional[ClassDetails]:
+        """Extract class details from a Google Forms confirmation, reusing results for identical emails."""
+        form_response = _slice_form_response(processed_email.metadata.body)
+        key = hashlib.blake2b(
+            f"{processed_email.metadata.subject}\n{form_response}".encode("utf-8"),
+            digest_size=16
+        ).hexdigest()
+        
+        if key in self._extraction_cache:
+            logger.info("Reusing cached class details for duplicate Google Forms confirmation")
+            return self._extraction_cache[key]
+        
+        # Only one extraction per unique email content may be in flight at a time
+        lock_entry = self._extraction_locks.setdefault(key, [asyncio.Lock(), 0])
+        lock_entry[1] += 1
+        try:
+            async with lock_entry[0]:
+                if key in self._extraction_cache:
+                    return self._extraction_cache[key]
+                
+                class_details = await self._request_google_forms_details(processed_email, form_response)
+                if class_details is not None:
+                    self._extraction_cache[key] = class_details
+                return class_details
+        finally:
+            # Drop the lock once no other extraction of this content is waiting on it
+            lock_entry[1] -= 1
+            if not lock_entry[1]:
+                del self._extraction_locks[key]
+    
+    async def _request_google_forms_details(
+        self,
+        processed_email: ProcessedEmail,
+        form_response: str
+    ) -> Optional[ClassDetails]:
         """Extract class details from Google Forms confirmation email using LLM."""
         try:
             logger.info("Using LLM to extract class details from Google Forms confirmation")
             
             # Create a specialized prompt for Google Forms extraction
-            prompt = f"""
-You are an AI assistant that extracts class details from Google Forms confirmation emails.
-
-Email Details:
-- Subject: {processed_email.metadata.subject}
-- Body: {processed_email.metadata.body}
-
-This is a Google Forms confirmation email for a boxing class registration. The email contains the user's form responses. Please carefully extract the following information from the email body and respond with a JSON object:
-
-{{
-    "class_name": "Exact class name from the form (e.g., 'INTERMEDIATE CLASS', 'BEGINNER CLASS', 'ADVANCE CLASS')",
-    "date": "Date in YYYY-MM-DD format (e.g., '2025-10-10' for Friday, October 10)",
-    "time": "Time in HH:MM format (e.g., '18:15' for 6:15pm)",
-    "instructor": "Instructor/coach name (e.g., 'Coach Hashim', 'Hashim')",
-    "location": "Location/address if mentioned",
-    "class_type": "Type of class (e.g., 'boxing', 'kickboxing', 'fitness')",
-    "difficulty": "Difficulty level (e.g., 'intermediate', 'beginner', 'advanced')",
-    "duration_minutes": "Duration in minutes if mentioned",
-    "equipment_needed": ["List of equipment needed"],
-    "notes": "Any additional notes"
-}}
-
-CRITICAL: Look for the CLASS SCHEDULE section in the email. The user's selected class will be marked with a checkmark (✓) symbol.
-
-IMPORTANT: DO NOT extract from the first line in the CLASS SCHEDULE section. The first line is NOT the selected class.
-
-The selected class will have a checkmark (✓) symbol. Look for this exact pattern:
-
-✓
-INTERMEDIATE CLASS - Friday, October 10 @ 6:15pm -- Coach Hashim
-
-OR
-
-✓ INTERMEDIATE CLASS - Friday, October 10 @ 6:15pm -- Coach Hashim
-
-The checkmark (✓) indicates the user's selection. Extract ONLY from the line that has the checkmark (✓).
-
-Extract the EXACT information from the line that has the checkmark (✓). Parse:
-- Class name: "INTERMEDIATE CLASS"
-- Date: "Friday, October 10" → convert to "2025-10-10"
-- Time: "6:15pm" → convert to "18:15"
-- Coach: "Coach Hashim" or just "Hashim"
-
-WARNING: Do not extract from any line without a checkmark (✓). Only extract from the line that has the checkmark symbol.
-
-If any information is not available, use null for that field.
-
-Respond with valid JSON only, no additional text.
-"""
+            prompt = _GOOGLE_FORMS_PROMPT.substitute(
+                subject=processed_email.metadata.subject,
+                body=form_response
+            )
             
-            # Use LLM to extract details
-            if settings.llm_provider == "openai":
-                response = self.llm_service.client.chat.completions.create(
-                    model=settings.llm_model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.1
-                )
-                llm_response = response.choices[0].message.content
-            elif settings.llm_provider == "anthropic":
-                response = self.llm_service.client.messages.create(
-                    model=settings.llm_model,
-                    max_tokens=1000,
-                    temperature=0.1,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                llm_response = response.content[0].text
-            else:
-                raise ValueError(f"Unsupported LLM provider: {settings.llm_provider}")
+            # Use LLM to extract details, sharing the classification concurrency limit
+            async with self._llm_sem:
+                llm_response = await self._call_extraction_llm(prompt)
             
             # Parse the JSON response
-            import json
             logger.info(f"Raw LLM response: {llm_response}")
             
-            # Strip markdown code blocks if present
-            llm_response_clean = llm_response.strip()
-            if llm_response_clean.startswith("```json"):
-                llm_response_clean = llm_response_clean[7:]  # Remove ```json
-            if llm_response_clean.startswith("```"):
-                llm_response_clean = llm_response_clean[3:]  # Remove ```
-            if llm_response_clean.endswith("```"):
-                llm_response_clean = llm_response_clean[:-3]  # Remove trailing ```
-            llm_response_clean = llm_response_clean.strip()
-            
-            extracted_data = json.loads(llm_response_clean)
+            extracted_data = parse_json_response(llm_response)
             logger.info(f"Parsed extraction data: {extracted_data}")
             
             # Create ClassDetails object
@@ -372,35 +528,57 @@ Respond with valid JSON only, no additional text.
             logger.error(f"Error extracting Google Forms details: {e}")
             return None
     
+    async def _call_extraction_llm(self, prompt: str) -> str:
+        """Send the Google Forms extraction prompt to the configured LLM provider."""
+        if settings.llm_provider == "openai":
+            response = await self.llm_service.async_client.chat.completions.create(
+                model=settings.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+                response_format={"type": "json_object"},
+                seed=0
+            )
+            return response.choices[0].message.content
+        elif settings.llm_provider == "anthropic":
+            response = await self.llm_service.async_client.messages.create(
+                model=settings.llm_model,
+                max_tokens=1000,
+                temperature=0.1,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            return response.content[0].text
+        else:
+            raise ValueError(f"Unsupported LLM provider: {settings.llm_provider}")
+    
     async def _handle_cancellation_email(self, processed_email: ProcessedEmail) -> None:
         """Handle cancellation emails."""
         classification = processed_email.classification
         
-        logger.info(f"Found cancellation email: {processed_email.metadata.subject}")
+        logger.info("Found cancellation email: {}", processed_email.metadata.subject)
         
         if classification.class_details:
-            logger.info("Cancellation details:", classification.class_details.dict())
+            logger.opt(lazy=True).info("Cancellation details: {}", lambda: classification.class_details.model_dump())
         
         # Future: Could implement automatic calendar event cancellation here
         logger.info("Cancellation email processed - manual calendar cleanup may be needed")
         
-        # Mark email as read
-        self.gmail_service.mark_as_read(processed_email.metadata.id)
+        # Mark email as read and processed
+        await self._mark_processed(processed_email, mark_read=True)
     
     async def _handle_waitlist_email(self, processed_email: ProcessedEmail) -> None:
         """Handle waitlist emails."""
         classification = processed_email.classification
         
-        logger.info(f"Found waitlist email: {processed_email.metadata.subject}")
+        logger.info("Found waitlist email: {}", processed_email.metadata.subject)
         
         if classification.class_details:
-            logger.info("Waitlist details:", classification.class_details.dict())
+            logger.opt(lazy=True).info("Waitlist details: {}", lambda: classification.class_details.model_dump())
         
         # Future: Could implement waitlist management here
         logger.info("Waitlist email processed")
         
-        # Mark email as read
-        self.gmail_service.mark_as_read(processed_email.metadata.id)
+        # Mark email as read and processed
+        await self._mark_processed(processed_email, mark_read=True)
     
     def get_status(self) -> AgentStatus:
         """Get current agent status."""
@@ -412,4 +590,8 @@ Respond with valid JSON only, no additional text.
     
     def get_processed_emails(self) -> Set[str]:
         """Get set of processed email IDs."""
-        return self.processed_emails.copy()
+        return set(self.processed_emails.keys())
+    
+    def iter_processed_emails(self) -> Iterator[str]:
+        """Iterate over processed email IDs, oldest first, without copying them."""
+        return iter(self.processed_emails)
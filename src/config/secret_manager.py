@@ -1,19 +1,59 @@
 """Secret Manager integration for secure configuration management."""
 
+import json
 import os
-from typing import Optional
-from google.cloud import secretmanager
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
 from loguru import logger
 
 
+@lru_cache(maxsize=None)
+def _env_var_name(secret_name: str) -> str:
+    """Map a secret name to the environment variable that can override it."""
+    return secret_name.upper().replace("-", "_")
+
+
 class SecretManagerConfig:
     """Configuration manager that reads secrets from Google Cloud Secret Manager."""
     
+    # On-disk cache of fetched secrets, reused by warm container restarts; one file per project by default
+    CACHE_FILE = os.getenv("SECRET_CACHE_FILE")
+    CACHE_TTL_SECONDS = 60 * 60
+    
     def __init__(self, project_id: Optional[str] = None):
         """Initialize Secret Manager client."""
         self.project_id = project_id or os.getenv("GOOGLE_CLOUD_PROJECT", "boxing-gym-agent")
-        self.client = secretmanager.SecretManagerServiceClient()
+        self.cache_file = self.CACHE_FILE or os.path.join(
+            tempfile.gettempdir(), f"boxing_gym_secret_cache_{self.project_id}.json"
+        )
+        # Created on first use; secrets supplied through the environment never need it
+        self._client = None
+        self._client_lock = threading.Lock()
         self._cache = {}
+        # Secrets read from Secret Manager (not the environment) with the time they were read, mirrored to cache_file
+        self._fetched: Dict[str, Tuple[str, float]] = {}
+        # Per-secret locks so concurrent lookups of one secret share a single RPC
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # Names of secrets in the project, listed once on first use (None if listing is not permitted)
+        self._known: Optional[FrozenSet[str]] = None
+        self._known_loaded = False
+        self._known_lock = threading.Lock()
+        self._load_file_cache()
+    
+    @property
+    def client(self):
+        """Secret Manager client, created on first access."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from google.cloud import secretmanager
+                    self._client = secretmanager.SecretManagerServiceClient()
+        return self._client
     
     def get_secret(self, secret_name: str, default: Optional[str] = None) -> str:
         """Get a secret value from Secret Manager with caching."""
@@ -22,7 +62,7 @@ class SecretManagerConfig:
             return self._cache[secret_name]
         
         # First try to get from environment variable (for Cloud Run secrets)
-        env_var_name = secret_name.upper().replace("-", "_")
+        env_var_name = _env_var_name(secret_name)
         env_value = os.getenv(env_var_name)
         if env_value is not None:
             # Strip whitespace from environment variable
@@ -31,20 +71,16 @@ class SecretManagerConfig:
             logger.debug(f"Retrieved secret from environment: {secret_name}")
             return secret_value
         
+        known_secrets = self._known_secrets()
+        if known_secrets is not None and secret_name not in known_secrets:
+            logger.debug(f"Secret {secret_name} does not exist, using default")
+            return default if default is not None else ""
+        
         try:
-            # Build the resource name
-            name = f"projects/{self.project_id}/secrets/{secret_name}/versions/latest"
-            
-            # Access the secret version
-            response = self.client.access_secret_version(request={"name": name})
-            
-            # Decode the secret value and strip whitespace
-            secret_value = response.payload.data.decode("UTF-8").strip()
-            
-            # Cache the value
-            self._cache[secret_name] = secret_value
-            
-            logger.debug(f"Retrieved secret: {secret_name}")
+            secret_value, fetched = self._fetch_secret(secret_name)
+            if fetched:
+                self._save_file_cache()
+                logger.debug(f"Retrieved secret: {secret_name}")
             return secret_value
             
         except Exception as e:
@@ -56,6 +92,109 @@ class SecretManagerConfig:
             logger.info(f"No default provided for {secret_name}, returning empty string")
             return ""
     
+    def prefetch(self, secret_names: Iterable[str], max_workers: int = 16) -> None:
+        """Fetch several secrets from Secret Manager in parallel and cache them."""
+        pending = [
+            name for name in dict.fromkeys(secret_names)
+            if name not in self._cache and os.getenv(_env_var_name(name)) is None
+        ]
+        known_secrets = self._known_secrets() if pending else None
+        if known_secrets is not None:
+            pending = [name for name in pending if name in known_secrets]
+        if not pending:
+            return
+        
+        def fetch(secret_name: str) -> None:
+            try:
+                if self._fetch_secret(secret_name)[1]:
+                    logger.debug(f"Prefetched secret: {secret_name}")
+            except Exception as e:
+                logger.warning(f"Failed to prefetch secret {secret_name}: {e}")
+        
+        # The Secret Manager client is thread-safe, so one client serves every worker
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            list(executor.map(fetch, pending))
+        self._save_file_cache()
+    
+    def _known_secrets(self) -> Optional[FrozenSet[str]]:
+        """List the project's secret names once, or None if they cannot be listed."""
+        with self._known_lock:
+            if not self._known_loaded:
+                try:
+                    secrets = self.client.list_secrets(request={"parent": f"projects/{self.project_id}"})
+                    self._known = frozenset(secret.name.rsplit("/", 1)[-1] for secret in secrets)
+                    logger.debug(f"Found {len(self._known)} secrets in project {self.project_id}")
+                except Exception as e:
+                    # Accessor-only service accounts cannot list secrets; fall back to per-secret lookups
+                    logger.debug(f"Could not list secrets, looking them up individually: {e}")
+                self._known_loaded = True
+            return self._known
+    
+    def _fetch_secret(self, secret_name: str) -> Tuple[str, bool]:
+        """Read a secret into the cache once, returning its value and whether this call fetched it."""
+        with self._locks_guard:
+            lock = self._locks.setdefault(secret_name, threading.Lock())
+        
+        with lock:
+            # Another thread may have fetched it while we waited
+            if secret_name in self._cache:
+                return self._cache[secret_name], False
+            
+            secret_value = self._access_secret(secret_name)
+            self._cache[secret_name] = secret_value
+            self._fetched[secret_name] = (secret_value, time.time())
+            return secret_value, True
+    
+    def _access_secret(self, secret_name: str) -> str:
+        """Read the latest version of a secret from Secret Manager."""
+        # Build the resource name
+        name = f"projects/{self.project_id}/secrets/{secret_name}/versions/latest"
+        
+        # Access the secret version
+        response = self.client.access_secret_version(request={"name": name})
+        
+        # Decode the secret value and strip whitespace
+        return response.payload.data.decode("UTF-8").strip()
+    
+    def _load_file_cache(self) -> None:
+        """Load secrets cached on disk by a previous process that have not expired."""
+        try:
+            with open(self.cache_file, 'r') as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        
+        # A file written for another project (e.g. a shared SECRET_CACHE_FILE) must not be reused
+        if not isinstance(cached, dict) or cached.get("project_id") != self.project_id:
+            logger.warning(f"Ignoring secret cache file {self.cache_file}, it was not written for project {self.project_id}")
+            return
+        
+        # Each entry expires CACHE_TTL_SECONDS after it was read from Secret Manager,
+        # however often the file has been rewritten since
+        expires_before = time.time() - self.CACHE_TTL_SECONDS
+        for secret_name, entry in cached.get("secrets", {}).items():
+            if not isinstance(entry, list) or len(entry) != 2 or not isinstance(entry[1], (int, float)):
+                continue
+            secret_value, fetched_at = entry
+            # Environment variables still take precedence over cached values
+            if fetched_at >= expires_before and os.getenv(_env_var_name(secret_name)) is None:
+                self._cache[secret_name] = secret_value
+                self._fetched[secret_name] = (secret_value, fetched_at)
+        logger.debug(f"Loaded {len(self._fetched)} secrets from {self.cache_file}")
+    
+    def _save_file_cache(self) -> None:
+        """Atomically write fetched secrets to the owner-only cache file."""
+        if not self._fetched:
+            return
+        try:
+            # mkstemp creates the file with 0600 permissions
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_file))
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump({"project_id": self.project_id, "secrets": dict(self._fetched)}, cache_file)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logger.warning(f"Could not write secret cache file: {e}")
+    
     def get_boolean_secret(self, secret_name: str, default: bool = False) -> bool:
         """Get a boolean secret value."""
         value = self.get_secret(secret_name, str(default).lower())
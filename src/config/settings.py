@@ -1,13 +1,62 @@
 """Configuration management for the Boxing Gym Agent."""
 
 import os
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple, Type
 from pydantic import Field, field_validator
-from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
+from pydantic.fields import FieldInfo
+from pydantic_settings import BaseSettings, PydanticBaseSettingsSource
+from loguru import logger
 
-# Load environment variables (for local development)
-load_dotenv()
+# Load environment variables (for local development); Cloud Run sets K_SERVICE and ships no .env file
+if not os.getenv("K_SERVICE"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+class SecretManagerSettingsSource(PydanticBaseSettingsSource):
+    """Settings source that reads sensitive fields from Secret Manager when the environment lacks them."""
+    
+    SECRET_FIELDS = (
+        "google_client_id",
+        "google_client_secret",
+        "gmail_user_email",
+        "openai_api_key",
+        "anthropic_api_key",
+    )
+    PROVIDER_KEY_FIELDS = {
+        "openai": "openai_api_key",
+        "anthropic": "anthropic_api_key",
+    }
+    
+    def get_field_value(self, field: FieldInfo, field_name: str) -> Tuple[Any, str, bool]:
+        # Values are resolved together in __call__ so only needed secrets are fetched
+        return None, field_name, False
+    
+    def __call__(self) -> Dict[str, Any]:
+        provider_default = self.settings_cls.model_fields["llm_provider"].default
+        provider = os.getenv("LLM_PROVIDER", provider_default).strip()
+        unused_keys = {
+            field for name, field in self.PROVIDER_KEY_FIELDS.items() if name != provider
+        }
+        
+        # Only ask Secret Manager for fields this run needs and the environment did not set
+        missing = [
+            field for field in self.SECRET_FIELDS
+            if field not in unused_keys and os.getenv(field.upper()) is None
+        ]
+        if not missing:
+            return {}
+        
+        try:
+            from .secret_manager import secret_manager
+            secret_names = {field: field.replace("_", "-") for field in missing}
+            secret_manager.prefetch(secret_names.values())
+            values = {field: secret_manager.get_secret(name) for field, name in secret_names.items()}
+        except Exception as e:
+            logger.warning(f"Could not load settings from Secret Manager: {e}")
+            return {}
+        
+        return {field: value for field, value in values.items() if value}
 
 
 class Settings(BaseSettings):
@@ -47,23 +96,51 @@ class Settings(BaseSettings):
     check_interval_minutes: int = Field(default=5, env="CHECK_INTERVAL_MINUTES")
     log_level: str = Field(default="INFO", env="LOG_LEVEL")
     max_emails_per_check: int = Field(default=10, env="MAX_EMAILS_PER_CHECK")
+    llm_concurrency: int = Field(default=5, ge=1, env="LLM_CONCURRENCY")
     
     # Processing Configuration
     confidence_threshold: float = Field(default=0.7, env="CONFIDENCE_THRESHOLD")
     enable_auto_registration: bool = Field(default=False, env="ENABLE_AUTO_REGISTRATION")
     enable_calendar_creation: bool = Field(default=True, env="ENABLE_CALENDAR_CREATION")
     
-    @field_validator('*', mode='before')
+    # Web API Configuration
+    api_key: Optional[str] = Field(default=None, env="API_KEY")
+    enable_api_docs: bool = Field(default=True, env="ENABLE_API_DOCS")
+    
+    @field_validator(
+        'check_interval_minutes', 'max_emails_per_check', 'llm_concurrency',
+        'confidence_threshold', 'enable_auto_registration', 'enable_calendar_creation',
+        'enable_api_docs', mode='before'
+    )
     @classmethod
     def strip_whitespace(cls, v):
-        """Strip whitespace from all string values."""
+        """Strip whitespace from raw values of non-string fields."""
         if isinstance(v, str):
             return v.strip()
         return v
     
+    @classmethod
+    def settings_customise_sources(
+        cls,
+        settings_cls: Type[BaseSettings],
+        init_settings: PydanticBaseSettingsSource,
+        env_settings: PydanticBaseSettingsSource,
+        dotenv_settings: PydanticBaseSettingsSource,
+        file_secret_settings: PydanticBaseSettingsSource,
+    ) -> Tuple[PydanticBaseSettingsSource, ...]:
+        """Fall back to Secret Manager for sensitive values missing from the environment."""
+        return (
+            init_settings,
+            env_settings,
+            dotenv_settings,
+            SecretManagerSettingsSource(settings_cls),
+            file_secret_settings,
+        )
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
+        str_strip_whitespace = True
 
 
 # Global settings instance
@@ -1,36 +1,44 @@
 """Main entry point for the Boxing Gym Agent."""
 
 import asyncio
+import os
 import signal
 import sys
 from pathlib import Path
 from loguru import logger
 
+# Skip pydantic-core's self-check of every generated schema; it must be set before models are imported
+os.environ.setdefault("PYDANTIC_SKIP_VALIDATING_CORE_SCHEMAS", "true")
+
 from .agents.boxing_gym_agent import BoxingGymAgent
 from .config.settings import validate_settings
 
+# Create logs directory if it doesn't exist
+LOGS_DIR = Path("logs")
+LOGS_DIR.mkdir(exist_ok=True)
+
 
 class BoxingGymAgentApp:
     """Main application class for the Boxing Gym Agent."""
     
     def __init__(self):
         self.agent = BoxingGymAgent()
-        self._setup_signal_handlers()
     
     def _setup_signal_handlers(self):
         """Set up signal handlers for graceful shutdown."""
-        def signal_handler(signum, frame):
+        def signal_handler(signum):
             logger.info(f"Received signal {signum}, shutting down gracefully...")
             self.agent.stop()
-            sys.exit(0)
         
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, signal_handler, signum)
     
     async def run(self):
         """Run the application."""
         try:
             logger.info("Starting Boxing Gym Agent Application...")
+            self._setup_signal_handlers()
             
             # Validate settings first
             validate_settings()
@@ -44,9 +52,8 @@ class BoxingGymAgentApp:
             logger.info("Boxing Gym Agent is now running!")
             logger.info("Press Ctrl+C to stop the agent")
             
-            # Keep the application running
-            while self.agent.is_running:
-                await asyncio.sleep(1)
+            # Keep the application running until the agent is stopped
+            await self.agent.wait_until_stopped()
                 
         except KeyboardInterrupt:
             logger.info("Received keyboard interrupt, shutting down...")
@@ -54,15 +61,12 @@ class BoxingGymAgentApp:
             logger.error(f"Fatal error: {e}")
             sys.exit(1)
         finally:
-            self.agent.stop()
+            if self.agent.is_running:
+                self.agent.stop()
 
 
 async def main():
     """Main function."""
-    # Create logs directory if it doesn't exist
-    logs_dir = Path("logs")
-    logs_dir.mkdir(exist_ok=True)
-    
     # Create and run the application
     app = BoxingGymAgentApp()
     await app.run()
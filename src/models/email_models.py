@@ -1,12 +1,28 @@
 """Pydantic models for email processing."""
 
-from typing import Optional, List, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
-from pydantic import BaseModel, Field
+from enum import Enum
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class EmailType(str, Enum):
+    """Email types the LLM can assign to an email."""
+    REGISTRATION_FORM = "registration_form"
+    CONFIRMATION = "confirmation"
+    CANCELLATION = "cancellation"
+    WAITLIST = "waitlist"
+    OTHER = "other"
+    
+    def __str__(self) -> str:
+        """Format as the plain value, as StrEnum does on Python 3.11+."""
+        return self.value
 
 
 class EmailMetadata(BaseModel):
     """Email metadata extracted from Gmail."""
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+    
     id: str
     thread_id: str
     subject: str
@@ -19,6 +35,8 @@ class EmailMetadata(BaseModel):
 
 class ClassDetails(BaseModel):
     """Class information extracted from emails."""
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+    
     class_name: Optional[str] = None
     date: Optional[str] = None
     time: Optional[str] = None
@@ -27,17 +45,19 @@ class ClassDetails(BaseModel):
     class_type: Optional[str] = None
     difficulty: Optional[str] = None
     duration_minutes: Optional[int] = None
-    equipment_needed: Optional[List[str]] = None
+    equipment_needed: Optional[Tuple[str, ...]] = None
     notes: Optional[str] = None
 
 
 class EmailClassification(BaseModel):
     """LLM classification of email type and content."""
-    email_type: str = Field(..., description="Type of email: registration_form, confirmation, cancellation, waitlist, other")
+    model_config = ConfigDict(frozen=True)
+    
+    email_type: EmailType = Field(..., description="Type of email: registration_form, confirmation, cancellation, waitlist, other")
     confidence: float = Field(..., ge=0.0, le=1.0, description="Confidence score for classification")
     class_details: Optional[ClassDetails] = None
     action_required: str = Field(..., description="Action to take: register, create_calendar, cancel_event, waitlist, none")
-    form_links: Optional[List[str]] = None
+    form_links: Optional[Tuple[str, ...]] = None
     registration_url: Optional[str] = None
     reasoning: str = Field(..., description="LLM reasoning for the classification")
 
@@ -52,12 +72,14 @@ class ProcessedEmail(BaseModel):
 
 class CalendarEvent(BaseModel):
     """Calendar event details."""
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+    
     summary: str
     description: str
     start_time: datetime
     end_time: datetime
     location: Optional[str] = None
-    attendees: Optional[List[str]] = None
+    attendees: Optional[Tuple[str, ...]] = None
     reminders: Optional[Dict[str, Any]] = None
     source: Optional[Dict[str, str]] = None
 
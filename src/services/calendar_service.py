@@ -1,7 +1,15 @@
 """Google Calendar service for event management."""
 
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Tuple
+from datetime import date, datetime, timedelta
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from loguru import logger
@@ -10,26 +18,93 @@ from ..config.settings import settings
 from ..models.email_models import ClassDetails, CalendarEvent
 
 
+_MONTHS = {
+    'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
+    'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12
+}
+_DATE_SLASH_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+_DATE_NAMED_RE = re.compile(r',\s*(' + '|'.join(_MONTHS) + r')\s+(\d{1,2})\b')
+_TIME_12H_RE = re.compile(r'^(\d{1,2})(?::(\d{2}))?\s*([ap])m$', re.IGNORECASE)
+_TIME_24H_RE = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+
 class CalendarService:
     """Service for Google Calendar operations."""
     
+    # Maximum number of known event UIDs remembered in memory
+    KNOWN_UIDS_MAX = 1024
+    
+    # Reminders attached to every class event; shared across events and never mutated
+    EVENT_REMINDERS = {
+        'useDefault': False,
+        'overrides': [
+            {'method': 'email', 'minutes': 24 * 60},  # 24 hours before
+            {'method': 'popup', 'minutes': 30},       # 30 minutes before
+        ],
+    }
+    
+    # Socket timeout for Calendar API requests
+    HTTP_TIMEOUT_SECONDS = 10
+    
     def __init__(self, credentials):
-        self.service = build('calendar', 'v3', credentials=credentials)
+        self.credentials = credentials
+        # httplib2 connections are not thread-safe, so each thread executes requests on its own
+        self._local = threading.local()
+        # Use the discovery document bundled with the client library rather than fetching it
+        self.service = build('calendar', 'v3', http=self._http(), cache_discovery=False, static_discovery=True)
+        # UIDs of events this process created or found, most recently used last
+        self._known_uids: OrderedDict[str, None] = OrderedDict()
+        # Per-UID lock and the number of threads holding or waiting for it
+        self._uid_locks: Dict[str, List[Any]] = {}
+        self._uid_guard = threading.Lock()
+    
+    def _http(self) -> AuthorizedHttp:
+        """Get the authorized HTTP client for the current thread, keeping its connection alive between calls."""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.HTTP_TIMEOUT_SECONDS))
+            self._local.http = http
+        return http
+    
+    async def create_class_event_async(self, class_details: ClassDetails, email_id: str) -> Optional[Dict[str, Any]]:
+        """Create a calendar event for a boxing class without blocking the event loop."""
+        return await asyncio.to_thread(self.create_class_event, class_details, email_id)
     
     def create_class_event(self, class_details: ClassDetails, email_id: str) -> Optional[Dict[str, Any]]:
         """Create a calendar event for a boxing class."""
         try:
             event_details = self._build_event_details(class_details, email_id)
+            uid = event_details['iCalUID']
             
-            # Check if event already exists
-            if self._event_exists(event_details):
-                logger.info("Calendar event already exists for this class")
-                return None
+            # Concurrent requests for the same class wait for the first one to finish
+            with self._uid_guard:
+                uid_entry = self._uid_locks.setdefault(uid, [threading.Lock(), 0])
+                uid_entry[1] += 1
             
-            event = self.service.events().insert(
-                calendarId=settings.calendar_id,
-                body=event_details
-            ).execute()
+            try:
+                with uid_entry[0]:
+                    # Skip the lookup for events this process already knows about
+                    if self._is_known_uid(uid):
+                        logger.info("Calendar event already exists for this class")
+                        return None
+                    
+                    # Check if event already exists
+                    if self._event_exists(event_details):
+                        self._remember_uid(uid)
+                        logger.info("Calendar event already exists for this class")
+                        return None
+                    
+                    event = self.service.events().insert(
+                        calendarId=settings.calendar_id,
+                        body=event_details
+                    ).execute(http=self._http())
+                    self._remember_uid(uid)
+            finally:
+                # Drop the lock once no other request for this class is waiting on it
+                with self._uid_guard:
+                    uid_entry[1] -= 1
+                    if not uid_entry[1]:
+                        del self._uid_locks[uid]
             
             logger.info(f"Created calendar event: {event['id']}")
             return event
@@ -38,6 +113,22 @@ class CalendarService:
             logger.error(f"Error creating calendar event: {error}")
             raise
     
+    def _is_known_uid(self, uid: str) -> bool:
+        """Check whether an event UID is already known, marking it as recently used."""
+        with self._uid_guard:
+            if uid not in self._known_uids:
+                return False
+            self._known_uids.move_to_end(uid)
+            return True
+    
+    def _remember_uid(self, uid: str) -> None:
+        """Record a known event UID, evicting the least recently used beyond KNOWN_UIDS_MAX."""
+        with self._uid_guard:
+            self._known_uids[uid] = None
+            self._known_uids.move_to_end(uid)
+            if len(self._known_uids) > self.KNOWN_UIDS_MAX:
+                self._known_uids.popitem(last=False)
+    
     def _build_event_details(self, class_details: ClassDetails, email_id: str) -> Dict[str, Any]:
         """Build calendar event details from class information."""
         # Parse start time
@@ -55,6 +146,7 @@ class CalendarService:
         
         return {
             'summary': summary,
+            'iCalUID': self._event_uid(summary, start_time),
             'description': description,
             'start': {
                 'dateTime': start_time.isoformat(),
@@ -71,18 +163,14 @@ class CalendarService:
                     'responseStatus': 'accepted',
                 }
             ],
-            'reminders': {
-                'useDefault': False,
-                'overrides': [
-                    {'method': 'email', 'minutes': 24 * 60},  # 24 hours before
-                    {'method': 'popup', 'minutes': 30},       # 30 minutes before
-                ],
-            },
+            'reminders': self.EVENT_REMINDERS,
             # Note: Removed source URL as gmail:// format is not supported by Calendar API
             # The email ID is included in the description instead
         }
     
-    def _build_event_description(self, class_details: ClassDetails, email_id: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_event_description(class_details: ClassDetails, email_id: str) -> str:
         """Build event description from class details."""
         description_parts = [
             "Boxing class registration confirmed.",
@@ -115,104 +203,98 @@ class CalendarService:
     def _parse_class_time(self, class_details: ClassDetails) -> datetime:
         """Parse class date and time into datetime object."""
         try:
-            # Parse date
-            if class_details.date:
-                date_str = class_details.date.strip()
-                
-                if '/' in date_str:
-                    # MM/DD/YYYY format
-                    month, day, year = date_str.split('/')
-                    date_obj = datetime(int(year), int(month), int(day))
-                elif '-' in date_str:
-                    # YYYY-MM-DD format
-                    date_obj = datetime.fromisoformat(date_str)
-                elif ',' in date_str and any(month in date_str for month in ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']):
-                    # "Friday, October 10" format
-                    try:
-                        # Extract month and day from "Friday, October 10"
-                        parts = date_str.split(',')
-                        if len(parts) >= 2:
-                            month_day = parts[1].strip()
-                            month_name, day = month_day.split()
-                            month_num = {
-                                'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
-                                'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12
-                            }.get(month_name, 1)
-                            # Assume current year
-                            year = datetime.now().year
-                            date_obj = datetime(year, month_num, int(day))
-                        else:
-                            raise ValueError("Invalid date format")
-                    except (ValueError, KeyError):
-                        # Fallback to default
-                        date_obj = datetime.now().date()
-                else:
-                    # Try to parse as ISO format
-                    try:
-                        date_obj = datetime.fromisoformat(date_str)
-                    except ValueError:
-                        # Fallback to today
-                        date_obj = datetime.now().date()
-            else:
-                # Default to today
-                date_obj = datetime.now().date()
+            date_obj = self._parse_class_date(class_details.date)
+            hour, minute = self._parse_class_clock(class_details.time)
             
-            # Parse time
-            if class_details.time:
-                time_str = class_details.time.strip()
-                
-                # Handle various time formats
-                if ':' in time_str:
-                    if 'am' in time_str.lower() or 'pm' in time_str.lower():
-                        # 12-hour format (e.g., "6:15pm", "6:15 PM")
-                        time_part = time_str.replace('am', '').replace('pm', '').replace('AM', '').replace('PM', '').strip()
-                        hour, minute = map(int, time_part.split(':'))
-                        
-                        if 'pm' in time_str.lower() and hour != 12:
-                            hour += 12
-                        elif 'am' in time_str.lower() and hour == 12:
-                            hour = 0
-                    else:
-                        # 24-hour format (e.g., "18:15")
-                        hour, minute = map(int, time_str.split(':'))
-                    
-                    # Combine date and time
-                    return datetime.combine(date_obj, datetime.min.time().replace(hour=hour, minute=minute))
-                else:
-                    # Just hour (e.g., "6" for 6 PM)
-                    hour = int(time_str)
-                    if hour < 12:  # Assume PM if hour < 12
-                        hour += 12
-                    return datetime.combine(date_obj, datetime.min.time().replace(hour=hour))
-            else:
-                # Default to 6 PM if no time specified
-                return datetime.combine(date_obj, datetime.min.time().replace(hour=18))
+            # Combine date and time
+            return datetime(date_obj.year, date_obj.month, date_obj.day, hour, minute)
                 
         except (ValueError, AttributeError) as e:
             logger.error(f"Error parsing class time: {e}")
             logger.error(f"Date: {class_details.date}, Time: {class_details.time}")
             # Default to tomorrow at 6 PM
-            return datetime.now().replace(hour=18, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            tomorrow = date.today() + timedelta(days=1)
+            return datetime(tomorrow.year, tomorrow.month, tomorrow.day, 18, 0)
+    
+    def _parse_class_date(self, date_value: Optional[str]) -> date:
+        """Parse a class date, defaulting to today when it is missing or unrecognized."""
+        if not date_value:
+            return datetime.now().date()
+        
+        date_str = date_value.strip()
+        
+        # MM/DD/YYYY format
+        match = _DATE_SLASH_RE.match(date_str)
+        if match:
+            month, day, year = match.groups()
+            return datetime(int(year), int(month), int(day))
+        
+        # YYYY-MM-DD format
+        if '-' in date_str:
+            return datetime.fromisoformat(date_str)
+        
+        # "Friday, October 10" format, assuming the current year
+        match = _DATE_NAMED_RE.search(date_str)
+        if match:
+            try:
+                return datetime(datetime.now().year, _MONTHS[match.group(1)], int(match.group(2)))
+            except ValueError:
+                return datetime.now().date()
+        
+        # Try to parse as ISO format, falling back to today
+        try:
+            return datetime.fromisoformat(date_str)
+        except ValueError:
+            return datetime.now().date()
+    
+    def _parse_class_clock(self, time_value: Optional[str]) -> Tuple[int, int]:
+        """Parse a class time into (hour, minute), defaulting to 6 PM when it is missing."""
+        if not time_value:
+            return 18, 0
+        
+        time_str = time_value.strip()
+        
+        # 12-hour format (e.g., "6:15pm", "6:15 PM", "6pm")
+        match = _TIME_12H_RE.match(time_str)
+        if match:
+            hour = int(match.group(1))
+            minute = int(match.group(2) or 0)
+            is_pm = match.group(3).lower() == 'p'
+            if is_pm and hour != 12:
+                hour += 12
+            elif not is_pm and hour == 12:
+                hour = 0
+            return hour, minute
+        
+        # 24-hour format (e.g., "18:15")
+        match = _TIME_24H_RE.match(time_str)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        
+        # Just hour (e.g., "6" for 6 PM)
+        if time_str.isdigit():
+            hour = int(time_str)
+            if hour < 12:  # Assume PM if hour < 12
+                hour += 12
+            return hour, 0
+        
+        raise ValueError(f"Unrecognized class time: {time_value}")
+    
+    def _event_uid(self, summary: str, start_time: datetime) -> str:
+        """Build a deterministic iCalendar UID for a class so duplicates can be found by UID."""
+        digest = hashlib.sha1(f"{summary}|{start_time.isoformat()}".encode("utf-8")).hexdigest()
+        return f"{digest}@boxing-gym-agent"
     
     def _event_exists(self, event_details: Dict[str, Any]) -> bool:
         """Check if an event already exists for the same time and class."""
         try:
-            start_time = datetime.fromisoformat(event_details['start']['dateTime'].replace('Z', '+00:00'))
-            end_time = datetime.fromisoformat(event_details['end']['dateTime'].replace('Z', '+00:00'))
-            
             events_result = self.service.events().list(
                 calendarId=settings.calendar_id,
-                timeMin=start_time.isoformat(),
-                timeMax=end_time.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+                iCalUID=event_details['iCalUID'],
+                maxResults=1
+            ).execute(http=self._http())
             
-            # Check if any event has a similar summary
-            class_name = event_details['summary'].split(' - ')[0]
-            return any(class_name in event.get('summary', '') for event in events)
+            return bool(events_result.get('items'))
             
         except Exception as e:
             logger.error(f"Error checking for existing events: {e}")
@@ -225,7 +307,7 @@ class CalendarService:
                 calendarId=settings.calendar_id,
                 eventId=event_id,
                 body=updates
-            ).execute()
+            ).execute(http=self._http())
             
             logger.info(f"Updated calendar event: {event_id}")
             return event
@@ -240,7 +322,7 @@ class CalendarService:
             self.service.events().delete(
                 calendarId=settings.calendar_id,
                 eventId=event_id
-            ).execute()
+            ).execute(http=self._http())
             
             logger.info(f"Deleted calendar event: {event_id}")
             return True
@@ -258,7 +340,7 @@ class CalendarService:
                 timeMax=end_date.isoformat(),
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            ).execute(http=self._http())
             
             return events_result.get('items', [])
             
@@ -2,19 +2,102 @@
 
 import base64
 import json
+import os
+import re
+import tempfile
+import threading
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from loguru import logger
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 from ..config.settings import settings
 from ..models.email_models import EmailMetadata
 
 
+# Credentials loaded by earlier authenticate() calls in this process, keyed by token file
+_credentials_cache: Dict[str, Credentials] = {}
+_credentials_lock = threading.Lock()
+
+
+# Message headers copied into EmailMetadata
+_WANTED_HEADERS = frozenset({'subject', 'from', 'to', 'date'})
+
+# Canonical RFC 2822 date, e.g. "Fri, 10 Oct 2025 18:15:00 -0700 (PDT)"
+_DATE_HEADER_RE = re.compile(
+    r'^(?:[A-Za-z]{3}, )?(\d{1,2}) ([A-Za-z]{3}) (\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-]\d{4})(?: \([A-Za-z]+\))?$'
+)
+_MONTH_ABBREVIATIONS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+_timezones: Dict[str, timezone] = {}
+
+
+def _parse_date_header(date_str: str) -> datetime:
+    """Parse a Date header, handling the canonical RFC 2822 form without the generic stdlib parser."""
+    match = _DATE_HEADER_RE.match(date_str)
+    # "-0000" means an unknown zone, which the stdlib parser turns into a naive datetime
+    if not match or match.group(2) not in _MONTH_ABBREVIATIONS or match.group(7) == '-0000':
+        return parsedate_to_datetime(date_str)
+    
+    day, month, year, hour, minute, second, offset = match.groups()
+    tz = _timezones.get(offset)
+    if tz is None:
+        minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+        tz = _timezones.setdefault(offset, timezone(timedelta(minutes=-minutes if offset[0] == '-' else minutes)))
+    return datetime(
+        int(year), _MONTH_ABBREVIATIONS[month], int(day), int(hour), int(minute), int(second), tzinfo=tz
+    )
+
+
+# Gmail responses worth retrying: rate limiting and transient server errors
+_RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+_retry_backoff = wait_exponential_jitter(initial=1, max=30)
+# Cap on the Retry-After delay so a single retry never sleeps longer than this
+_RETRY_AFTER_MAX_SECONDS = 30
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """Check whether a Gmail request failed with a status worth retrying."""
+    return isinstance(error, HttpError) and error.resp.status in _RETRYABLE_STATUSES
+
+
+def _retry_wait(retry_state) -> float:
+    """Wait as long as the server's Retry-After header asks, else back off exponentially with jitter."""
+    error = retry_state.outcome.exception()
+    retry_after = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), _RETRY_AFTER_MAX_SECONDS)
+    return _retry_backoff(retry_state)
+
+
+def _log_retry(retry_state) -> None:
+    """Log a Gmail request that is about to be retried."""
+    logger.warning(
+        "Gmail request failed ({}), retrying in {:.1f}s",
+        retry_state.outcome.exception(),
+        retry_state.next_action.sleep
+    )
+
+
+_gmail_retry = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=_retry_wait,
+    stop=stop_after_attempt(5),
+    before_sleep=_log_retry,
+    reraise=True
+)
+
+
 class GmailService:
     """Service for Gmail API operations."""
     
@@ -24,34 +107,46 @@ class GmailService:
         'https://www.googleapis.com/auth/calendar',  # Full calendar access
     ]
     
+    BATCH_SIZE = 100
+    # Gmail accepts at most this many message IDs per batchModify call
+    BATCH_MODIFY_SIZE = 1000
+    PROCESSED_LABEL = "boxing-gym-processed"
+    
+    # Socket timeout for Gmail API requests
+    HTTP_TIMEOUT_SECONDS = 30
+    
     def __init__(self):
         self.service = None
         self.credentials = None
+        # httplib2 connections are not thread-safe, so each thread executes requests on its own
+        self._local = threading.local()
+        # Label name -> ID, loaded on first use; label IDs never change for a mailbox
+        self._label_cache: Dict[str, str] = {}
+        self._labels_loaded = False
+        self._labels_lock = threading.Lock()
+    
+    def _http(self) -> AuthorizedHttp:
+        """Get the authorized HTTP client for the current thread, keeping its connection alive between calls."""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.HTTP_TIMEOUT_SECONDS))
+            self._local.http = http
+        return http
+    
+    @_gmail_retry
+    def _execute(self, request):
+        """Execute a Gmail request or batch on this thread's connection, retrying rate limits and server errors."""
+        return request.execute(http=self._http())
     
     def authenticate(self, token_file: str = "tokens.json") -> None:
         """Authenticate with Gmail API using OAuth2."""
-        creds = None
+        with _credentials_lock:
+            creds = _credentials_cache.get(token_file)
         
-        # Try to load credentials from Secret Manager first
-        try:
-            from ..config.secret_manager import secret_manager
-            tokens_json = secret_manager.get_secret("gmail-tokens")
-            creds = Credentials.from_authorized_user_info(
-                json.loads(tokens_json), self.SCOPES
-            )
-            logger.info("Loaded credentials from Secret Manager")
-        except Exception as e:
-            logger.info(f"Could not load credentials from Secret Manager: {e}")
-            
-            # Fallback to local file
-            try:
-                with open(token_file, 'r') as token:
-                    creds = Credentials.from_authorized_user_info(
-                        json.load(token), self.SCOPES
-                    )
-                logger.info("Loaded credentials from local file")
-            except FileNotFoundError:
-                logger.info("No existing token file found")
+        if creds is not None:
+            logger.info("Reusing credentials loaded earlier in this process")
+        else:
+            creds = self._load_credentials(token_file)
         
         # If there are no (valid) credentials available, let the user log in
         if not creds or not creds.valid:
@@ -73,13 +168,67 @@ class GmailService:
                 creds = flow.run_local_server(port=8080)
             
             # Save the credentials for the next run
-            with open(token_file, 'w') as token:
-                token.write(creds.to_json())
+            self._save_credentials(creds, token_file)
+        
+        with _credentials_lock:
+            _credentials_cache[token_file] = creds
         
         self.credentials = creds
-        self.service = build('gmail', 'v1', credentials=creds)
+        self._local = threading.local()
+        self.service = build('gmail', 'v1', http=self._http(), cache_discovery=False, static_discovery=True)
         logger.info("Gmail authentication successful")
     
+    def _load_credentials(self, token_file: str) -> Optional[Credentials]:
+        """Load saved credentials from Secret Manager, falling back to the local token file."""
+        creds = None
+        
+        # Try to load credentials from Secret Manager first
+        try:
+            from ..config.secret_manager import secret_manager
+            tokens_json = secret_manager.get_secret("gmail-tokens")
+            creds = Credentials.from_authorized_user_info(
+                json.loads(tokens_json), self.SCOPES
+            )
+            logger.info("Loaded credentials from Secret Manager")
+        except Exception as e:
+            logger.info(f"Could not load credentials from Secret Manager: {e}")
+            
+            # Fallback to local file
+            try:
+                with open(token_file, 'r') as token:
+                    creds = Credentials.from_authorized_user_info(
+                        json.load(token), self.SCOPES
+                    )
+                logger.info("Loaded credentials from local file")
+            except FileNotFoundError:
+                logger.info("No existing token file found")
+        
+        return creds
+    
+    def _save_credentials(self, creds: Credentials, token_file: str) -> None:
+        """Atomically write credentials to the token file, skipping the write when nothing changed."""
+        tokens_json = creds.to_json()
+        try:
+            with open(token_file, 'r') as token:
+                if token.read() == tokens_json:
+                    return
+        except OSError:
+            pass
+        
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(token_file)))
+        with os.fdopen(fd, 'w') as token:
+            token.write(tokens_json)
+        os.replace(tmp_path, token_file)
+    
+    def refresh_credentials(self, token_file: str = "tokens.json") -> None:
+        """Refresh the OAuth2 access token and save it for the next run."""
+        if not self.credentials:
+            raise RuntimeError("Gmail service not authenticated")
+        
+        self.credentials.refresh(Request())
+        self._save_credentials(self.credentials, token_file)
+        logger.info("Refreshed Gmail credentials")
+    
     def get_auth_url(self) -> str:
         """Get authorization URL for OAuth2 flow."""
         flow = InstalledAppFlow.from_client_config(
@@ -96,19 +245,26 @@ class GmailService:
         )
         return flow.authorization_url()[0]
     
-    def search_emails(self, query: Optional[str] = None, max_results: int = 10) -> List[Dict[str, str]]:
-        """Search for emails matching the query."""
+    def search_emails(
+        self,
+        query: Optional[str] = None,
+        max_results: int = 10,
+        extra_query: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Search for emails matching the query, optionally narrowed by extra query terms."""
         if not self.service:
             raise RuntimeError("Gmail service not authenticated")
         
         query = query or settings.gmail_query
+        if extra_query:
+            query = f"{query} {extra_query}"
         
         try:
-            results = self.service.users().messages().list(
+            results = self._execute(self.service.users().messages().list(
                 userId='me',
                 q=query,
                 maxResults=max_results
-            ).execute()
+            ))
             
             messages = results.get('messages', [])
             logger.info(f"Found {len(messages)} emails matching query: {query}")
@@ -124,11 +280,11 @@ class GmailService:
             raise RuntimeError("Gmail service not authenticated")
         
         try:
-            message = self.service.users().messages().get(
+            message = self._execute(self.service.users().messages().get(
                 userId='me',
                 id=message_id,
                 format='full'
-            ).execute()
+            ))
             
             return self._parse_email(message)
             
@@ -136,25 +292,69 @@ class GmailService:
             logger.error(f"Error getting email {message_id}: {error}")
             raise
     
-    def mark_as_read(self, message_id: str) -> None:
-        """Mark email as read."""
+    def batch_get_emails(self, message_ids: List[str]) -> List[EmailMetadata]:
+        """Get details for several emails using batched HTTP requests."""
+        if not self.service:
+            raise RuntimeError("Gmail service not authenticated")
+        
+        emails: Dict[str, EmailMetadata] = {}
+        
+        def handle_response(request_id: str, response: Dict[str, Any], exception: Optional[HttpError]) -> None:
+            if exception is not None:
+                logger.error(f"Error getting email {request_id}: {exception}")
+                return
+            emails[request_id] = self._parse_email(response)
+        
+        # Gmail accepts at most BATCH_SIZE sub-requests per batch call
+        for start in range(0, len(message_ids), self.BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=handle_response)
+            for message_id in message_ids[start:start + self.BATCH_SIZE]:
+                batch.add(
+                    self.service.users().messages().get(
+                        userId='me',
+                        id=message_id,
+                        format='full'
+                    ),
+                    request_id=message_id
+                )
+            self._execute(batch)
+        
+        return [emails[message_id] for message_id in message_ids if message_id in emails]
+    
+    def modify_labels(
+        self,
+        message_id: str,
+        add_label_ids: Optional[List[str]] = None,
+        remove_label_ids: Optional[List[str]] = None
+    ) -> None:
+        """Add and remove labels on an email in a single request."""
         if not self.service:
             raise RuntimeError("Gmail service not authenticated")
         
+        body = {}
+        if add_label_ids:
+            body['addLabelIds'] = add_label_ids
+        if remove_label_ids:
+            body['removeLabelIds'] = remove_label_ids
+        
         try:
-            self.service.users().messages().modify(
+            self._execute(self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            logger.info(f"Marked email {message_id} as read")
+                body=body
+            ))
             
         except HttpError as error:
-            logger.error(f"Error marking email as read: {error}")
+            logger.error(f"Error modifying labels on email {message_id}: {error}")
             raise
     
-    def mark_as_processed(self, message_id: str, label_name: str = "boxing-gym-processed") -> None:
-        """Mark an email as processed by adding a Gmail label."""
+    def mark_as_read(self, message_id: str) -> None:
+        """Mark email as read."""
+        self.modify_labels(message_id, remove_label_ids=['UNREAD'])
+        logger.info(f"Marked email {message_id} as read")
+    
+    def mark_as_processed(self, message_id: str, label_name: str = PROCESSED_LABEL, mark_read: bool = False) -> None:
+        """Mark an email as processed by adding a Gmail label, optionally marking it read in the same request."""
         if not self.service:
             raise RuntimeError("Gmail service not authenticated")
         
@@ -163,29 +363,77 @@ class GmailService:
             label_id = self._get_or_create_label(label_name)
             
             # Add label to the message
-            self.service.users().messages().modify(
-                userId='me',
-                id=message_id,
-                body={'addLabelIds': [label_id]}
-            ).execute()
+            self.modify_labels(
+                message_id,
+                add_label_ids=[label_id],
+                remove_label_ids=['UNREAD'] if mark_read else None
+            )
             logger.info(f"Marked email {message_id} as processed with label '{label_name}'")
         except HttpError as error:
             logger.error(f"Error marking email {message_id} as processed: {error}")
     
+    def refresh_labels(self) -> Dict[str, str]:
+        """Reload the label name to ID map from Gmail, e.g. after a label was renamed."""
+        if not self.service:
+            raise RuntimeError("Gmail service not authenticated")
+        
+        try:
+            results = self._execute(self.service.users().labels().list(userId='me'))
+        except HttpError as error:
+            logger.error(f"Error listing labels: {error}")
+            raise
+        
+        with self._labels_lock:
+            self._label_cache = {label['name']: label['id'] for label in results.get('labels', [])}
+            self._labels_loaded = True
+            return dict(self._label_cache)
+    
+    def batch_mark_as_processed(
+        self,
+        message_ids: List[str],
+        label_name: str = PROCESSED_LABEL,
+        mark_read: bool = False
+    ) -> None:
+        """Mark several emails as processed with one batchModify request per BATCH_MODIFY_SIZE emails."""
+        if not self.service:
+            raise RuntimeError("Gmail service not authenticated")
+        if not message_ids:
+            return
+        
+        try:
+            label_id = self._get_or_create_label(label_name)
+            body: Dict[str, Any] = {'addLabelIds': [label_id]}
+            if mark_read:
+                body['removeLabelIds'] = ['UNREAD']
+            
+            for start in range(0, len(message_ids), self.BATCH_MODIFY_SIZE):
+                chunk = message_ids[start:start + self.BATCH_MODIFY_SIZE]
+                self._execute(self.service.users().messages().batchModify(
+                    userId='me',
+                    body={**body, 'ids': chunk}
+                ))
+            logger.info(f"Marked {len(message_ids)} emails as processed with label '{label_name}'")
+        except HttpError as error:
+            logger.error(f"Error marking {len(message_ids)} emails as processed: {error}")
+    
     def _get_or_create_label(self, label_name: str) -> str:
         """Get or create a Gmail label and return its ID."""
         if not self.service:
             raise RuntimeError("Gmail service not authenticated")
         
+        with self._labels_lock:
+            label_id = self._label_cache.get(label_name)
+            labels_loaded = self._labels_loaded
+        if label_id:
+            return label_id
+        
         try:
-            # Try to find existing label
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
-            
-            for label in labels:
-                if label['name'] == label_name:
+            # Look the label up in a fresh listing before creating it
+            if not labels_loaded:
+                label_id = self.refresh_labels().get(label_name)
+                if label_id:
                     logger.debug(f"Found existing label: {label_name}")
-                    return label['id']
+                    return label_id
             
             # Create new label if not found
             label_object = {
@@ -193,11 +441,15 @@ class GmailService:
                 'labelListVisibility': 'labelShow',
                 'messageListVisibility': 'show'
             }
+            # Not retried: a create that timed out may still have made the label
             created_label = self.service.users().labels().create(
                 userId='me',
                 body=label_object
-            ).execute()
+            ).execute(http=self._http())
             logger.info(f"Created new label: {label_name}")
+            
+            with self._labels_lock:
+                self._label_cache[label_name] = created_label['id']
             return created_label['id']
             
         except HttpError as error:
@@ -208,8 +460,14 @@ class GmailService:
         """Parse Gmail message into EmailMetadata."""
         headers = message['payload'].get('headers', [])
         
-        # Extract headers
-        header_dict = {h['name'].lower(): h['value'] for h in headers}
+        # Extract only the headers that are used, stopping once all are found
+        header_dict: Dict[str, str] = {}
+        for header in headers:
+            name = header['name'].lower()
+            if name in _WANTED_HEADERS and name not in header_dict:
+                header_dict[name] = header['value']
+                if len(header_dict) == len(_WANTED_HEADERS):
+                    break
         
         subject = header_dict.get('subject', '')
         from_email = header_dict.get('from', '')
@@ -218,8 +476,7 @@ class GmailService:
         
         # Parse date
         try:
-            from email.utils import parsedate_to_datetime
-            date = parsedate_to_datetime(date_str)
+            date = _parse_date_header(date_str)
         except (ValueError, TypeError):
             date = datetime.now()
         
@@ -238,27 +495,19 @@ class GmailService:
         )
     
     def _extract_body(self, payload: Dict[str, Any]) -> str:
-        """Extract email body from payload."""
-        body = ""
-        
+        """Extract email body from payload, preferring the text/plain part over text/html."""
         if 'body' in payload and 'data' in payload['body']:
             # Single part message
-            body = base64.urlsafe_b64decode(
-                payload['body']['data']
-            ).decode('utf-8', errors='ignore')
-        elif 'parts' in payload:
-            # Multi-part message
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    if 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8', errors='ignore')
-                        break
-                elif part['mimeType'] == 'text/html' and not body:
-                    if 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8', errors='ignore')
+            data = payload['body']['data']
+        else:
+            # Multi-part message: decode only the part that is used
+            parts = [part for part in payload.get('parts', []) if 'data' in part['body']]
+            part = (
+                next((part for part in parts if part['mimeType'] == 'text/plain'), None)
+                or next((part for part in parts if part['mimeType'] == 'text/html'), None)
+            )
+            if part is None:
+                return ""
+            data = part['body']['data']
         
-        return body
+        return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
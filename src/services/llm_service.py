@@ -1,69 +1,61 @@
 """LLM service for intelligent email processing."""
 
-import json
-from typing import Dict, Any, Optional
+import hashlib
+import re
+import string
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+import orjson
+from bs4 import BeautifulSoup
+from cachetools import TTLCache
 from loguru import logger
 
 from ..config.settings import settings
-from ..models.email_models import EmailMetadata, EmailClassification, ClassDetails
+from ..models.email_models import EmailMetadata, EmailClassification, ClassDetails, EmailType
 
 
-class LLMService:
-    """Service for LLM-based email processing."""
-    
-    def __init__(self):
-        self.provider = settings.llm_provider
-        self.model = settings.llm_model
-        self._setup_client()
-    
-    def _setup_client(self):
-        """Set up the LLM client based on provider."""
-        if self.provider == "openai":
-            import openai
-            openai.api_key = settings.openai_api_key
-            self.client = openai.OpenAI(api_key=settings.openai_api_key)
-        elif self.provider == "anthropic":
-            import anthropic
-            self.client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
-        else:
-            raise ValueError(f"Unsupported LLM provider: {self.provider}")
+_HTML_TAG_RE = re.compile(r"<[a-zA-Z][^>]*>")
+# Start of a quoted reply or a signature; everything after it is dropped
+_REPLY_OR_SIGNATURE_RE = re.compile(r"^-- ?$|^On .* wrote:$", re.MULTILINE)
+_WHITESPACE_RE = re.compile(r"\s+")
+# Markdown code fence some models wrap their JSON replies in
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def html_to_text(body: str) -> str:
+    """Convert an HTML email body to text with one line per block, leaving plain text unchanged."""
+    if _HTML_TAG_RE.search(body):
+        return BeautifulSoup(body, "lxml").get_text("\n")
+    return body
+
+
+@lru_cache(maxsize=256)
+def _clean_body(body: str) -> str:
+    """Reduce an email body to plain text without quoted replies, signatures or repeated whitespace."""
+    body = html_to_text(body)
     
-    def classify_email(self, email: EmailMetadata) -> EmailClassification:
-        """Classify email and extract relevant information using LLM."""
-        try:
-            prompt = self._build_classification_prompt(email)
-            
-            if self.provider == "openai":
-                response = self._call_openai(prompt)
-            elif self.provider == "anthropic":
-                response = self._call_anthropic(prompt)
-            else:
-                raise ValueError(f"Unsupported provider: {self.provider}")
-            
-            return self._parse_classification_response(response)
-            
-        except Exception as e:
-            logger.error(f"Error classifying email: {e}")
-            # Return a fallback classification
-            return EmailClassification(
-                email_type="other",
-                confidence=0.0,
-                action_required="none",
-                reasoning=f"Error in classification: {str(e)}"
-            )
+    match = _REPLY_OR_SIGNATURE_RE.search(body)
+    if match:
+        body = body[:match.start()]
     
-    def _build_classification_prompt(self, email: EmailMetadata) -> str:
-        """Build the prompt for email classification."""
-        return f"""
+    return _WHITESPACE_RE.sub(" ", body).strip()
+
+
+def parse_json_response(response: str) -> Any:
+    """Parse a JSON reply from the LLM, ignoring a surrounding markdown code fence."""
+    return orjson.loads(_CODE_FENCE_RE.sub("", response.strip()))
+
+
+_CLASSIFICATION_PROMPT = string.Template("""
 You are an AI assistant that processes emails for a boxing gym automation system. 
 Analyze the following email and classify it, then extract relevant information.
 
 Email Details:
-- Subject: {email.subject}
-- From: {email.from_email}
-- Date: {email.date}
-- Snippet: {email.snippet}
-- Body: {email.body[:2000]}...
+- Subject: $subject
+- From: $from_email
+- Date: $date
+- Snippet: $snippet
+- Body: $body...
 
 Please analyze this email and respond with a JSON object containing:
 
@@ -113,7 +105,142 @@ Focus on:
 - Confirmation emails that should trigger calendar event creation
 
 Respond with valid JSON only, no additional text.
-"""
+""")
+
+
+@lru_cache(maxsize=4)
+def _get_client(provider: str, api_key: Optional[str]):
+    """Get the shared SDK client, and with it the connection pool, for a provider and key."""
+    if provider == "openai":
+        import openai
+        return openai.OpenAI(api_key=api_key)
+    elif provider == "anthropic":
+        import anthropic
+        return anthropic.Anthropic(api_key=api_key)
+    raise ValueError(f"Unsupported LLM provider: {provider}")
+
+
+@lru_cache(maxsize=4)
+def _get_async_client(provider: str, api_key: Optional[str]):
+    """Get the shared async SDK client for a provider and key."""
+    if provider == "openai":
+        import openai
+        return openai.AsyncOpenAI(api_key=api_key)
+    elif provider == "anthropic":
+        import anthropic
+        return anthropic.AsyncAnthropic(api_key=api_key)
+    raise ValueError(f"Unsupported LLM provider: {provider}")
+
+
+class LLMService:
+    """Service for LLM-based email processing."""
+    
+    # Bounds for the cache of classifications keyed by email content
+    CLASSIFICATION_CACHE_SIZE = 1024
+    CLASSIFICATION_CACHE_TTL_SECONDS = 24 * 60 * 60
+    
+    # Only ask the LLM again for class details the classification left out if it was at least this confident
+    EXTRACTION_FALLBACK_MIN_CONFIDENCE = 0.5
+    
+    def __init__(self):
+        self.provider = settings.llm_provider
+        self.model = settings.llm_model
+        self._classification_cache: TTLCache = TTLCache(
+            maxsize=self.CLASSIFICATION_CACHE_SIZE,
+            ttl=self.CLASSIFICATION_CACHE_TTL_SECONDS
+        )
+        self._setup_client()
+    
+    def _setup_client(self):
+        """Set up the LLM client based on provider."""
+        if self.provider == "openai":
+            api_key = settings.openai_api_key
+        elif self.provider == "anthropic":
+            api_key = settings.anthropic_api_key
+        else:
+            raise ValueError(f"Unsupported LLM provider: {self.provider}")
+        
+        self.client = _get_client(self.provider, api_key)
+        self.async_client = _get_async_client(self.provider, api_key)
+    
+    def classify_email(self, email: EmailMetadata) -> EmailClassification:
+        """Classify email and extract relevant information using LLM."""
+        try:
+            cache_key, cached, prompt = self._prepare_classification(email)
+            if cached is not None:
+                return cached
+            
+            if self.provider == "openai":
+                response = self._call_openai(prompt)
+            else:
+                response = self._call_anthropic(prompt)
+            
+            return self._finish_classification(cache_key, response)
+            
+        except Exception as e:
+            return self._classification_error(e)
+    
+    async def classify_email_async(self, email: EmailMetadata) -> EmailClassification:
+        """Classify email like classify_email without blocking the event loop."""
+        try:
+            cache_key, cached, prompt = self._prepare_classification(email)
+            if cached is not None:
+                return cached
+            
+            if self.provider == "openai":
+                response = await self._call_openai_async(prompt)
+            else:
+                response = await self._call_anthropic_async(prompt)
+            
+            return self._finish_classification(cache_key, response)
+            
+        except Exception as e:
+            return self._classification_error(e)
+    
+    def _prepare_classification(self, email: EmailMetadata) -> Tuple[str, Optional[EmailClassification], Optional[str]]:
+        """Return the cache key with either a cached classification or the prompt to send."""
+        if self.provider not in ("openai", "anthropic"):
+            raise ValueError(f"Unsupported provider: {self.provider}")
+        
+        cache_key = self._classification_key(email)
+        cached = self._classification_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Using cached classification for email {}", email.id)
+            return cache_key, cached, None
+        
+        return cache_key, None, self._build_classification_prompt(email)
+    
+    def _finish_classification(self, cache_key: str, response: str) -> EmailClassification:
+        """Parse an LLM response, caching it unless it is a fallback produced by a failed response."""
+        classification = self._parse_classification_response(response)
+        if classification.confidence > 0.0:
+            self._classification_cache[cache_key] = classification
+        return classification
+    
+    def _classification_error(self, error: Exception) -> EmailClassification:
+        """Log a failed classification and return the fallback classification."""
+        logger.error(f"Error classifying email: {error}")
+        return EmailClassification(
+            email_type=EmailType.OTHER,
+            confidence=0.0,
+            action_required="none",
+            reasoning=f"Error in classification: {str(error)}"
+        )
+    
+    def _classification_key(self, email: EmailMetadata) -> str:
+        """Hash the sender, subject and cleaned body, so templated emails sent on different days share a classification."""
+        content = "\0".join((email.from_email, email.subject, _clean_body(email.body)[:2000]))
+        return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _build_classification_prompt(self, email: EmailMetadata) -> str:
+        """Build the prompt for email classification."""
+        return _CLASSIFICATION_PROMPT.substitute(
+            subject=email.subject,
+            from_email=email.from_email,
+            date=email.date,
+            snippet=email.snippet,
+            body=_clean_body(email.body)[:2000]
+        )
     
     def _call_openai(self, prompt: str) -> str:
         """Call OpenAI API."""
@@ -124,7 +251,8 @@ Respond with valid JSON only, no additional text.
                 {"role": "user", "content": prompt}
             ],
             temperature=0.1,
-            max_tokens=1000
+            max_tokens=1000,
+            response_format={"type": "json_object"}
         )
         return response.choices[0].message.content
     
@@ -140,18 +268,36 @@ Respond with valid JSON only, no additional text.
         )
         return response.content[0].text
     
+    async def _call_openai_async(self, prompt: str) -> str:
+        """Call OpenAI API with the async client."""
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that processes emails for boxing gym automation. Always respond with valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.1,
+            max_tokens=1000,
+            response_format={"type": "json_object"}
+        )
+        return response.choices[0].message.content
+    
+    async def _call_anthropic_async(self, prompt: str) -> str:
+        """Call Anthropic API with the async client."""
+        response = await self.async_client.messages.create(
+            model=self.model,
+            max_tokens=1000,
+            temperature=0.1,
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
+        return response.content[0].text
+    
     def _parse_classification_response(self, response: str) -> EmailClassification:
         """Parse LLM response into EmailClassification object."""
         try:
-            # Clean the response to extract JSON
-            response = response.strip()
-            if response.startswith("```json"):
-                response = response[7:]
-            if response.endswith("```"):
-                response = response[:-3]
-            response = response.strip()
-            
-            data = json.loads(response)
+            data = parse_json_response(response)
             
             # Extract class details if present
             class_details = None
@@ -170,8 +316,14 @@ Respond with valid JSON only, no additional text.
                     notes=class_data.get("notes")
                 )
             
+            # Treat types outside the known set as "other" rather than failing validation
+            try:
+                email_type = EmailType(data.get("email_type", EmailType.OTHER))
+            except ValueError:
+                email_type = EmailType.OTHER
+            
             return EmailClassification(
-                email_type=data.get("email_type", "other"),
+                email_type=email_type,
                 confidence=float(data.get("confidence", 0.0)),
                 class_details=class_details,
                 action_required=data.get("action_required", "none"),
@@ -180,13 +332,13 @@ Respond with valid JSON only, no additional text.
                 reasoning=data.get("reasoning", "")
             )
             
-        except (json.JSONDecodeError, KeyError, ValueError) as e:
+        except (orjson.JSONDecodeError, KeyError, ValueError) as e:
             logger.error(f"Error parsing LLM response: {e}")
             logger.error(f"Response was: {response}")
             
             # Return fallback classification
             return EmailClassification(
-                email_type="other",
+                email_type=EmailType.OTHER,
                 confidence=0.0,
                 action_required="none",
                 reasoning=f"Error parsing response: {str(e)}"
@@ -194,12 +346,17 @@ Respond with valid JSON only, no additional text.
     
     def extract_class_details(self, email: EmailMetadata) -> Optional[ClassDetails]:
         """Extract class details from email using LLM."""
+        # The classification prompt already asks for class details, and its result is cached
+        classification = self.classify_email(email)
+        if classification.class_details or classification.confidence <= self.EXTRACTION_FALLBACK_MIN_CONFIDENCE:
+            return classification.class_details
+        
         try:
             prompt = f"""
 Extract class details from this boxing gym email:
 
 Subject: {email.subject}
-Body: {email.body[:1500]}...
+Body: {_clean_body(email.body)[:1500]}...
 
 Return a JSON object with:
 - class_name: Name of the class
@@ -221,7 +378,7 @@ If any field is not found, use null. Return valid JSON only.
             elif self.provider == "anthropic":
                 response = self._call_anthropic(prompt)
             
-            data = json.loads(response.strip())
+            data = parse_json_response(response)
             return ClassDetails(**data)
             
         except Exception as e:
@@ -15,7 +15,8 @@ def setup_logger():
         sys.stdout,
         level=settings.log_level,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        colorize=True
+        # Only emit ANSI colour codes to a terminal, not to Cloud Logging
+        colorize=sys.stdout.isatty()
     )
     
     # Add file logger for all logs
@@ -25,7 +26,11 @@ def setup_logger():
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
         rotation="10 MB",
         retention="30 days",
-        compression="zip"
+        compression="zip",
+        # Write, rotate and compress on loguru's background thread instead of the caller's
+        enqueue=True,
+        backtrace=False,
+        diagnose=False
     )
     
     # Add file logger for errors only
@@ -35,7 +40,10 @@ def setup_logger():
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
         rotation="5 MB",
         retention="90 days",
-        compression="zip"
+        compression="zip",
+        enqueue=True,
+        backtrace=False,
+        diagnose=False
     )
     
     logger.info("Logging system initialized")
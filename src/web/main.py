@@ -1,16 +1,29 @@
 """Web interface for the Boxing Gym Agent on Cloud Run."""
 
 import asyncio
+import hashlib
+import hmac
+import itertools
 import json
+import os
+import time
 from datetime import datetime
-from typing import Dict, Any
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from typing import Dict, Any, Optional, Tuple
+
+# Skip pydantic-core's self-check of every generated schema; it must be set before pydantic is imported
+os.environ.setdefault("PYDANTIC_SKIP_VALIDATING_CORE_SCHEMAS", "true")
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.security import APIKeyHeader
+from loguru import logger
 from pydantic import BaseModel
 import uvicorn
 
 from src.agents.boxing_gym_agent import BoxingGymAgent
-from src.config.settings import validate_settings
+from src.config.secret_manager import secret_manager
+from src.config.settings import settings, validate_settings
 from src.models.email_models import AgentStatus
 
 
@@ -19,8 +32,19 @@ agent: BoxingGymAgent = None
 app = FastAPI(
     title="Boxing Gym Agent",
     description="LLM-powered email automation for boxing gym class management",
-    version="1.0.0"
+    version="1.0.0",
+    openapi_url="/openapi.json" if settings.enable_api_docs else None,
+    default_response_class=ORJSONResponse
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+
+async def require_api_key(api_key: str = Depends(api_key_header)) -> None:
+    """Reject requests without the configured X-API-Key header."""
+    if not settings.api_key or not api_key or not hmac.compare_digest(api_key, settings.api_key):
+        raise HTTPException(status_code=403, detail="Invalid or missing API key. Include X-API-Key header.")
 
 
 class HealthResponse(BaseModel):
@@ -31,6 +55,18 @@ class HealthResponse(BaseModel):
     processed_emails: int
 
 
+# Most recent health response and the monotonic time it was built
+HEALTH_CACHE_TTL_SECONDS = 1.0
+_health_cache: Optional[Tuple[float, HealthResponse]] = None
+
+# Held while /restart replaces the agent
+_restart_lock = asyncio.Lock()
+
+# Manual /process-email and /check-emails jobs are queued for a fixed pool of workers
+JOB_QUEUE_SIZE = 256
+JOB_WORKERS = 8
+
+
 class ProcessEmailRequest(BaseModel):
     """Request model for manual email processing."""
     message_id: str
@@ -40,15 +76,61 @@ class AgentResponse(BaseModel):
     """Agent status response model."""
     status: AgentStatus
     processed_emails_count: int
-    uptime: str
+    uptime_seconds: int
+
+
+async def _job_worker(queue: asyncio.Queue):
+    """Run queued manual jobs against the current agent."""
+    while True:
+        job, message_id = await queue.get()
+        try:
+            if not agent:
+                logger.warning("Dropping {} job, agent not initialized", job)
+            elif job == "process":
+                await agent.process_email(message_id)
+            else:
+                await agent.check_for_new_emails()
+        except Exception as e:
+            logger.exception("Error running {} job: {}", job, e)
+        finally:
+            queue.task_done()
+
+
+def _enqueue_job(job: str, message_id: Optional[str] = None) -> None:
+    """Queue a manual job, rejecting it with 429 when the queue is full."""
+    try:
+        app.state.job_queue.put_nowait((job, message_id))
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=429, detail="Too many queued jobs, retry later")
+
+
+def _etag_response(request: Request, content: Any) -> Response:
+    """Serialize content with an ETag, answering 304 if the client already has it."""
+    body = ORJSONResponse(content).body
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the agent on startup."""
     global agent
+    app.state.start_monotonic = time.monotonic()
+    
+    app.state.job_queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    app.state.job_workers = [
+        asyncio.create_task(_job_worker(app.state.job_queue)) for _ in range(JOB_WORKERS)
+    ]
+    
+    # Build the OpenAPI schema now rather than on the first /docs request
+    if app.openapi_url:
+        app.openapi()
+    
     try:
-        print("Boxing Gym Agent web service starting...")
+        logger.info("Boxing Gym Agent web service starting...")
         
         # Validate settings
         validate_settings()
@@ -57,25 +139,25 @@ async def startup_event():
         agent = BoxingGymAgent()
         await agent.initialize()
         
-        # Start agent in background
-        asyncio.create_task(agent.start())
+        # Start agent in background, keeping a reference so it can be cancelled on restart
+        app.state.agent_task = asyncio.create_task(agent.start())
         
-        print("Boxing Gym Agent started successfully")
+        logger.info("Boxing Gym Agent started successfully")
         
     except Exception as e:
-        print(f"Error starting agent: {e}")
         # Don't raise to allow container to start, but log the error
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error starting agent: {}", e)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown."""
     global agent
+    for worker in app.state.job_workers:
+        worker.cancel()
     if agent:
         agent.stop()
-        print("Boxing Gym Agent stopped")
+        logger.info("Boxing Gym Agent stopped")
 
 
 @app.get("/", response_model=Dict[str, str])
@@ -97,12 +179,20 @@ async def health_check():
     if not agent:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
-    return HealthResponse(
+    # Probes arrive every few seconds; reuse a response built within the last HEALTH_CACHE_TTL_SECONDS
+    global _health_cache
+    now = time.monotonic()
+    if _health_cache and now - _health_cache[0] < HEALTH_CACHE_TTL_SECONDS:
+        return _health_cache[1]
+    
+    response = HealthResponse(
         status="healthy",
         timestamp=datetime.now(),
         agent_running=agent.is_running,
         processed_emails=agent.get_processed_emails_count()
     )
+    _health_cache = (now, response)
+    return response
 
 
 @app.get("/status", response_model=AgentResponse)
@@ -116,72 +206,79 @@ async def get_agent_status():
     status = agent.get_status()
     processed_count = agent.get_processed_emails_count()
     
-    # Calculate uptime (simplified)
-    uptime = "Unknown"  # Could be enhanced with start time tracking
+    uptime_seconds = int(time.monotonic() - app.state.start_monotonic)
     
     return AgentResponse(
         status=status,
         processed_emails_count=processed_count,
-        uptime=uptime
+        uptime_seconds=uptime_seconds
     )
 
 
 @app.post("/process-email")
-async def process_email_manual(request: ProcessEmailRequest, background_tasks: BackgroundTasks):
+async def process_email_manual(request: ProcessEmailRequest):
     """Manually trigger email processing."""
     global agent
     
     if not agent:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
-    try:
-        # Process email in background
-        background_tasks.add_task(agent.process_email, request.message_id)
-        
-        return {
-            "message": f"Email {request.message_id} queued for processing",
-            "status": "queued"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
+    _enqueue_job("process", request.message_id)
+    
+    return {
+        "message": f"Email {request.message_id} queued for processing",
+        "status": "queued"
+    }
 
 
 @app.post("/check-emails")
-async def check_emails_manual(background_tasks: BackgroundTasks):
+async def check_emails_manual():
     """Manually trigger email checking."""
     global agent
     
     if not agent:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
-    try:
-        # Check emails in background
-        background_tasks.add_task(agent.check_for_new_emails)
-        
-        return {
-            "message": "Email check queued",
-            "status": "queued"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error checking emails: {str(e)}")
+    _enqueue_job("check")
+    
+    return {
+        "message": "Email check queued",
+        "status": "queued"
+    }
 
 
 @app.get("/processed-emails")
-async def get_processed_emails():
-    """Get list of processed email IDs."""
+async def get_processed_emails(
+    request: Request,
+    limit: int = Query(default=1000, ge=1, le=10000),
+    offset: int = Query(default=0, ge=0)
+):
+    """Get a page of processed email IDs."""
     global agent
     
     if not agent:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
-    processed_emails = list(agent.get_processed_emails())
+    processed_emails = list(itertools.islice(agent.iter_processed_emails(), offset, offset + limit))
     
-    return {
+    return _etag_response(request, {
         "processed_emails": processed_emails,
-        "count": len(processed_emails)
-    }
+        "count": len(processed_emails),
+        "total": agent.get_processed_emails_count(),
+        "offset": offset,
+        "limit": limit
+    })
+
+
+@app.get("/processed-emails/count")
+async def get_processed_emails_count():
+    """Get the number of processed emails without listing them."""
+    global agent
+    
+    if not agent:
+        raise HTTPException(status_code=503, detail="Agent not initialized")
+    
+    return {"count": agent.get_processed_emails_count()}
 
 
 @app.post("/restart")
@@ -192,24 +289,32 @@ async def restart_agent():
     if not agent:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
-    try:
-        # Stop current agent
-        agent.stop()
-        
-        # Reinitialize
-        agent = BoxingGymAgent()
-        await agent.initialize()
-        
-        # Start in background
-        asyncio.create_task(agent.start())
-        
-        return {
-            "message": "Agent restarted successfully",
-            "status": "restarted"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error restarting agent: {str(e)}")
+    if _restart_lock.locked():
+        raise HTTPException(status_code=409, detail="Agent restart already in progress")
+    
+    async with _restart_lock:
+        try:
+            # Stop current agent and wait for its start task to finish
+            agent.stop()
+            agent_task = getattr(app.state, "agent_task", None)
+            if agent_task:
+                agent_task.cancel()
+                await asyncio.gather(agent_task, return_exceptions=True)
+            
+            # Reinitialize
+            agent = BoxingGymAgent()
+            await agent.initialize()
+            
+            # Start in background
+            app.state.agent_task = asyncio.create_task(agent.start())
+            
+            return {
+                "message": "Agent restarted successfully",
+                "status": "restarted"
+            }
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error restarting agent: {str(e)}")
 
 
 @app.get("/logs")
@@ -224,55 +329,66 @@ async def get_recent_logs():
     }
 
 
-@app.get("/debug/secrets")
+# (environment variable, Secret Manager name, settings field) reported by /debug/secrets
+DEBUG_SECRETS = (
+    ('GOOGLE_CLIENT_ID', 'google-client-id', 'google_client_id'),
+    ('GOOGLE_CLIENT_SECRET', 'google-client-secret', 'google_client_secret'),
+    ('OPENAI_API_KEY', 'openai-api-key', 'openai_api_key'),
+    ('GMAIL_USER_EMAIL', 'gmail-user-email', 'gmail_user_email'),
+)
+
+
+def _mask_value(value):
+    """Truncate a sensitive value to its first 10 characters."""
+    if not value:
+        return None
+    if isinstance(value, str) and len(value) > 10:
+        return value[:10] + "..."
+    return value
+
+
+@app.get("/debug/secrets", dependencies=[Depends(require_api_key)])
 async def debug_secrets():
     """Debug endpoint to check secret loading sources."""
-    import os
-    from src.config.secret_manager import secret_manager
-    from src.config.settings import settings
-    
-    # Check environment variables
-    env_vars = {
-        'GOOGLE_CLIENT_ID': os.getenv('GOOGLE_CLIENT_ID'),
-        'GOOGLE_CLIENT_SECRET': os.getenv('GOOGLE_CLIENT_SECRET'),
-        'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY'),
-        'GMAIL_USER_EMAIL': os.getenv('GMAIL_USER_EMAIL')
-    }
+    # Read the secrets concurrently in worker threads so the event loop is not blocked
+    results = await asyncio.gather(
+        *(asyncio.to_thread(secret_manager.get_secret, secret_name) for _, secret_name, _ in DEBUG_SECRETS),
+        return_exceptions=True
+    )
     
-    # Check Secret Manager
+    # Compare environment variables, Secret Manager and the settings object in one pass
+    env_vars = {}
     secret_manager_vars = {}
-    secret_names = ['google-client-id', 'google-client-secret', 'openai-api-key', 'gmail-user-email']
-    for secret_name in secret_names:
-        try:
-            secret_manager_vars[secret_name] = secret_manager.get_secret(secret_name)
-        except Exception as e:
-            secret_manager_vars[secret_name] = f"Error: {e}"
-    
-    # Check settings object
-    settings_vars = {
-        'google_client_id': getattr(settings, 'google_client_id', None),
-        'google_client_secret': getattr(settings, 'google_client_secret', None),
-        'openai_api_key': getattr(settings, 'openai_api_key', None),
-        'gmail_user_email': getattr(settings, 'gmail_user_email', None)
-    }
-    
-    # Mask sensitive values
-    def mask_value(value):
-        if not value:
-            return None
-        if isinstance(value, str) and len(value) > 10:
-            return value[:10] + "..."
-        return value
+    settings_vars = {}
+    env_var_count = 0
+    secret_manager_count = 0
+    using_secret_manager = False
+    for (env_name, secret_name, field), result in zip(DEBUG_SECRETS, results):
+        env_value = os.getenv(env_name)
+        env_vars[env_name] = _mask_value(env_value)
+        if env_value:
+            env_var_count += 1
+        
+        if isinstance(result, Exception):
+            secret_manager_vars[secret_name] = _mask_value(f"Error: {result}")
+            using_secret_manager = True
+        else:
+            secret_manager_vars[secret_name] = _mask_value(result)
+            if result:
+                secret_manager_count += 1
+                using_secret_manager = True
+        
+        settings_vars[field] = _mask_value(getattr(settings, field, None))
     
     return {
-        "environment_variables": {k: mask_value(v) for k, v in env_vars.items()},
-        "secret_manager": {k: mask_value(v) for k, v in secret_manager_vars.items()},
-        "settings_object": {k: mask_value(v) for k, v in settings_vars.items()},
+        "environment_variables": env_vars,
+        "secret_manager": secret_manager_vars,
+        "settings_object": settings_vars,
         "analysis": {
-            "using_secret_manager": any(secret_manager_vars.values()),
-            "using_env_vars": any(env_vars.values()),
-            "secret_manager_count": sum(1 for v in secret_manager_vars.values() if v and not str(v).startswith("Error")),
-            "env_var_count": sum(1 for v in env_vars.values() if v)
+            "using_secret_manager": using_secret_manager,
+            "using_env_vars": env_var_count > 0,
+            "secret_manager_count": secret_manager_count,
+            "env_var_count": env_var_count
         }
     }
 
@@ -283,6 +399,8 @@ if __name__ == "__main__":
         "src.web.main:app",
         host="0.0.0.0",
         port=8080,
+        loop="uvloop",
+        http="httptools",
         reload=True,
         log_level="info"
     )
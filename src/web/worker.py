@@ -0,0 +1,9 @@
+"""Gunicorn worker class for the Boxing Gym Agent web service."""
+
+from uvicorn.workers import UvicornWorker
+
+
+class BoxingGymWorker(UvicornWorker):
+    """Uvicorn worker pinned to the uvloop event loop and httptools parser."""
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}